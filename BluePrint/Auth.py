@@ -2,7 +2,7 @@ from flask import Blueprint, request, jsonify
 from utils import schema
 from DataBaseManage import *
 
-User_Manager = UserManager()
+User_Manager = user_manager
 AUTH_BLUEPRINT = Blueprint("auth", __name__)
 
 
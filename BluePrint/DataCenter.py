@@ -3,7 +3,7 @@ from DataBaseManage import *
 from dataclasses import asdict
 from .Room import DeleteRoom, ModifyRoom
 
-DC_manager = DatacenterManager()
+DC_manager = dc_manager
 
 DATA_CENTER_BLUEPRINT = Blueprint("dc", __name__)
 
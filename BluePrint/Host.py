@@ -3,8 +3,8 @@ from DataBaseManage import *
 from dataclasses import asdict
 import traceback
 
-Rack_Manager = RackManager()
-Host_Manager = HostManager()
+Rack_Manager = rack_manager
+Host_Manager = host_manager
 HOST_BLUEPRINT = Blueprint("host", __name__)
 
 
@@ -47,6 +47,8 @@ def AddHost():
 
 @HOST_BLUEPRINT.route("/all", methods=["GET"])
 def GetAllHost():
+    # Read every host before responding, so the pooled connection is not
+    # held while a client downloads and database errors still become a 500
     host_list = Host_Manager.getAllHosts()
     ret_list = [asdict(host) for host in host_list if host is not None]
 
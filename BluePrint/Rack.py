@@ -5,10 +5,10 @@ from .Host import DeleteHost
 from dataclasses import asdict
 from utils.schema import Rack
 
-Host_Manager = HostManager()
-Service_Manager = ServiceManager()
-Room_Manager = RoomManager()
-Rack_Manager = RackManager()
+Host_Manager = host_manager
+Service_Manager = service_manager
+Room_Manager = room_manager
+Rack_Manager = rack_manager
 RACK_BLUEPRINT = Blueprint("rack", __name__)
 
 
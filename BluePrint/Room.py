@@ -3,8 +3,8 @@ from DataBaseManage import *
 from dataclasses import asdict
 from .Rack import DeleteRack, ModifyRack
 
-DC_Manager = DatacenterManager()
-Room_Manager = RoomManager()
+DC_Manager = dc_manager
+Room_Manager = room_manager
 ROOM_BLUEPRINT = Blueprint("room", __name__)
 
 
@@ -4,8 +4,8 @@ from DataBaseManage import *
 from dataclasses import asdict
 import traceback
 
-Host_Manager = HostManager()
-Service_Manager = ServiceManager()
+Host_Manager = host_manager
+Service_Manager = service_manager
 SERVICE_BLUEPRINT = Blueprint("service", __name__)
 
 
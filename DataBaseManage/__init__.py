@@ -1,10 +1,10 @@
 from DataBaseManage.connection import test_connection   
-from DataBaseManage.datacentermanager import DatacenterManager
-from DataBaseManage.roommanager import RoomManager
-from DataBaseManage.rackmanager import RackManager
-from DataBaseManage.hostmanager import HostManager
-from DataBaseManage.servicemanager import ServiceManager
-from DataBaseManage.usermanager import UserManager
+from DataBaseManage.datacentermanager import DatacenterManager, dc_manager
+from DataBaseManage.roommanager import RoomManager, room_manager
+from DataBaseManage.rackmanager import RackManager, rack_manager
+from DataBaseManage.hostmanager import HostManager, host_manager
+from DataBaseManage.servicemanager import ServiceManager, service_manager
+from DataBaseManage.usermanager import UserManager, user_manager
 
 # For easier imports
 __all__ = [
@@ -14,5 +14,11 @@ __all__ = [
     'RackManager',
     'HostManager',
     'ServiceManager',
-    'UserManager'
+    'UserManager',
+    'dc_manager',
+    'room_manager',
+    'rack_manager',
+    'host_manager',
+    'service_manager',
+    'user_manager',
 ]
\ No newline at end of file
@@ -0,0 +1,115 @@
+import copy
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a cached read stays valid, 0 disables the cache
+CACHE_TTL = float(os.environ.get("DC_CACHE_TTL", "30"))
+CACHE_MAXSIZE = int(os.environ.get("DC_CACHE_MAXSIZE", "1024"))
+
+
+class QueryCache:
+    """Thread-safe LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        # Bumped by every clear, so a read that started before a write cannot
+        # store its now stale result afterwards
+        self.version = 0
+
+    def get(self, key):
+        """
+        Get a cached value.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss or expired entry
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, version=None):
+        """
+        Store a value, evicting the least recently used entry when full.
+
+        Args:
+            key: Cache key
+            value: Value to cache
+            version (int, optional): Cache version read before the value was
+                computed. The value is dropped if the cache was cleared since.
+        """
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached value"""
+        with self._lock:
+            self._data.clear()
+            self.version += 1
+
+
+query_cache = QueryCache(CACHE_TTL, CACHE_MAXSIZE)
+
+
+def cached_query(func):
+    """
+    Cache the result of a manager read method, keyed by method name and arguments.
+
+    Callers get their own copy of the result, so mutating it does not affect
+    the cached value.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if query_cache.ttl <= 0:
+            return func(self, *args, **kwargs)
+        key = (func.__qualname__, args, tuple(sorted(kwargs.items())))
+        hit, value = query_cache.get(key)
+        if not hit:
+            version = query_cache.version
+            value = func(self, *args, **kwargs)
+            query_cache.set(key, value, version)
+        return copy.deepcopy(value)
+
+    return wrapper
+
+
+def invalidates_cache(func):
+    """
+    Clear the query cache around a manager write method.
+
+    Counts and assignments are shared between datacenters, rooms, racks, hosts
+    and services, so any write clears every cached read. The cache is also
+    cleared before the write, since some writes return a fresh read of what
+    they changed.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        query_cache.clear()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            query_cache.clear()
+
+    return wrapper
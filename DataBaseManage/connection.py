@@ -1,6 +1,15 @@
+import functools
+import hashlib
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import count, starmap
 import psycopg2
-from psycopg2.pool import SimpleConnectionPool
+import psycopg2.extensions
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
 # Database connection configuration
 DB_CONFIG = {
@@ -11,34 +20,461 @@ DB_CONFIG = {
     "port": int(os.environ.get("DB_PORT", "5433")),
 }
 
-# Create a connection pool
-pool = SimpleConnectionPool(1, 10, **DB_CONFIG)
+# Connection configuration for read-only queries, can point at a replica
+READ_DB_CONFIG = {
+    **DB_CONFIG,
+    "host": os.environ.get("DB_READ_HOST", DB_CONFIG["host"]),
+    "port": int(os.environ.get("DB_READ_PORT", DB_CONFIG["port"])),
+}
+
+# Most statements a connection keeps prepared, the least recently used one is
+# deallocated when another one is prepared
+PREPARED_MAX = int(os.environ.get("DB_PREPARED_MAX", "256"))
+# Times a connection runs a statement through execute_cached before preparing
+# it, so statements that are rarely repeated do not take a prepared slot
+PREPARE_THRESHOLD = int(os.environ.get("DB_PREPARE_THRESHOLD", "5"))
+
+
+class Connection(psycopg2.extensions.connection):
+    """Connection that remembers the statements prepared in its session"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Names of statements PREPAREd on this session in least recently
+        # used order, see execute_prepared
+        self.prepared_statements = OrderedDict()
+        # Executions of statements not prepared yet, see execute_cached
+        self.statement_uses = {}
+        # Client-side cursors kept open for reuse, keyed by cursor factory
+        self._cursors = {}
+
+    def reusable_cursor(self, cursor_factory=None):
+        """
+        Get a cursor that stays open and is reused by later borrowers.
+
+        A pooled connection is only used by one borrower at a time, so the
+        cursor is created once per cursor factory instead of on every call.
+
+        Args:
+            cursor_factory (type, optional): Cursor class. Defaults to the plain cursor.
+
+        Returns:
+            cursor: Open cursor of this connection
+        """
+        cursor = self._cursors.get(cursor_factory)
+        if cursor is None or cursor.closed:
+            cursor = self._cursors[cursor_factory] = self.cursor(
+                cursor_factory=cursor_factory
+            )
+        return cursor
+
+
+class ReadOnlyConnection(Connection):
+    """Connection whose session is read-only and in autocommit mode"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Set once per connection so readers skip BEGIN/ROLLBACK afterwards
+        self.set_session(readonly=True, autocommit=True)
+
+
+class ObjectCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that returns each row as an instance of its row_class.
+
+    Rows are passed positionally, so the selected columns must be in the field
+    order of row_class. Get a cursor class for a given row class from
+    object_cursor.
+    """
+
+    row_class = tuple
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self.row_class(*row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany() if size is None else super().fetchmany(size)
+        return list(starmap(self.row_class, rows))
+
+    def fetchall(self):
+        return list(starmap(self.row_class, super().fetchall()))
+
+    def __iter__(self):
+        return starmap(self.row_class, iter(super().__next__, None))
+
+
+@functools.cache
+def object_cursor(row_class: type) -> type[ObjectCursor]:
+    """
+    Get the cursor class that returns rows as row_class instances.
+
+    Args:
+        row_class (type): Class built from each row, e.g. a schema dataclass
+
+    Returns:
+        type[ObjectCursor]: Cursor class to pass as cursor_factory
+    """
+    return type(
+        f"{row_class.__name__}Cursor", (ObjectCursor,), {"row_class": row_class}
+    )
+
+
+# Pool sizes, applied to each pool. Keep DB_POOL_MAX (times the number of pools
+# and app processes) below the server's max_connections.
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", "2"))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", "20"))
+
+# Seconds a returned connection above POOL_MIN may stay idle before it is closed
+POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "600"))
+
+# Seconds a borrower waits for a connection when all POOL_MAX are in use
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+
+
+class CachingConnectionPool(ThreadedConnectionPool):
+    """
+    Thread-safe pool that keeps returned connections open until they idle out.
+
+    ThreadedConnectionPool closes a returned connection whenever minconn
+    connections are already idle, so every burst above minconn pays for a new
+    connection and session setup. This pool keeps up to maxconn connections
+    and only closes the ones above minconn that stayed idle for max_idle seconds.
+    A thread gets back the connection it used last whenever that one is idle,
+    and a borrower waits for a returned connection when all are in use.
+    """
+
+    def __init__(
+        self,
+        minconn,
+        maxconn,
+        *args,
+        max_idle=POOL_MAX_IDLE,
+        timeout=POOL_TIMEOUT,
+        **kwargs,
+    ):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # Signalled whenever a connection is returned, see getconn
+        self._returned = threading.Condition(self._lock)
+        # id(conn) -> time the idle connection was returned to the pool
+        self._idle_since = dict.fromkeys(map(id, self._pool), time.monotonic())
+        # Connection each thread borrowed last, see _getconn
+        self._affinity = threading.local()
+
+    def _close_idle(self):
+        """Close the oldest idle connections above minconn past max_idle"""
+        deadline = time.monotonic() - self.max_idle
+        # Connections are handed out from the end of the list, so the
+        # longest idle ones are at the front
+        while (
+            len(self._pool) > self.minconn
+            and self._idle_since.get(id(self._pool[0]), deadline) <= deadline
+        ):
+            conn = self._pool.pop(0)
+            self._idle_since.pop(id(conn), None)
+            conn.close()
+
+    def getconn(self, key=None):
+        """
+        Get a connection, waiting up to timeout seconds while all are in use.
+
+        ThreadedConnectionPool raises PoolError as soon as maxconn connections
+        are borrowed, so a short burst above maxconn fails requests instead of
+        queueing them.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._returned:
+            while True:
+                try:
+                    return self._getconn(key)
+                except PoolError:
+                    remaining = deadline - time.monotonic()
+                    if self.closed or len(self._used) < self.maxconn or remaining <= 0:
+                        raise
+                    self._returned.wait(remaining)
+
+    def putconn(self, conn=None, key=None, close=False):
+        with self._returned:
+            self._putconn(conn, key, close)
+            self._returned.notify()
+
+    def _getconn(self, key=None):
+        self._close_idle()
+        # Prefer the idle connection this thread used last, so the statements
+        # it prepared on that connection are reused. Idle connections are
+        # handed out from the end of the list.
+        last = getattr(self._affinity, "conn", None)
+        if last is not None and self._pool and self._pool[-1] is not last:
+            for i, conn in enumerate(self._pool):
+                if conn is last:
+                    self._pool.append(self._pool.pop(i))
+                    break
+        conn = super()._getconn(key)
+        self._idle_since.pop(id(conn), None)
+        self._affinity.conn = conn
+        return conn
+
+    def _putconn(self, conn, key=None, close=False):
+        if self.closed:
+            raise PoolError("connection pool is closed")
+
+        if key is None:
+            key = self._rused.get(id(conn))
+            if key is None:
+                raise PoolError("trying to put unkeyed connection")
+
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                # Server connection lost
+                conn.close()
+                self._idle_since.pop(id(conn), None)
+            else:
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                self._pool.append(conn)
+                self._idle_since[id(conn)] = time.monotonic()
+        else:
+            if not conn.closed:
+                conn.close()
+            self._idle_since.pop(id(conn), None)
+
+        del self._used[key]
+        del self._rused[id(conn)]
+        self._close_idle()
+
+
+# Pools are created on first use in each process, see get_pool
+_pool = None
+_read_pool = None
+_pool_lock = threading.Lock()
+# Pools inherited from the parent process. They are kept referenced and never
+# closed in the child, since closing would also end the parent's sessions.
+_inherited_pools = []
+
+
+def get_pool(readonly: bool = False) -> CachingConnectionPool:
+    """
+    Get the connection pool of the current process, creating it on first use.
+
+    Args:
+        readonly (bool, optional): Return the read-only pool. Defaults to False.
+
+    Returns:
+        CachingConnectionPool: The read-write or read-only pool
+    """
+    global _pool, _read_pool
+    current = _read_pool if readonly else _pool
+    if current is not None:
+        return current
+    with _pool_lock:
+        if readonly and _read_pool is None:
+            _read_pool = CachingConnectionPool(
+                POOL_MIN,
+                POOL_MAX,
+                connection_factory=ReadOnlyConnection,
+                **READ_DB_CONFIG,
+            )
+        elif not readonly and _pool is None:
+            _pool = CachingConnectionPool(
+                POOL_MIN, POOL_MAX, connection_factory=Connection, **DB_CONFIG
+            )
+        return _read_pool if readonly else _pool
+
+
+def _reset_pools_after_fork():
+    """Drop pools inherited through fork so the child opens its own connections"""
+    global _pool, _read_pool, _pool_lock
+    _inherited_pools.extend(p for p in (_pool, _read_pool) if p is not None)
+    _pool = None
+    _read_pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
 
 
 def test_connection():
-    """Test the database connection"""
+    """Test the database connection with a pooled connection"""
+    conn = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute("SELECT version();")
-        version = cur.fetchone()
-        print(f"Connected to database! PostgreSQL version: {version[0]}")
-        cur.close()
-        conn.close()
+        conn = get_pool().getconn()
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        print("Connected to database!")
         return True  # 返回成功結果
     except Exception as e:
         print(f"Database connection failed: {e}")
         return False  # 返回失敗結果
+    finally:
+        if conn:
+            get_pool().putconn(conn)
+
+
+@functools.lru_cache(maxsize=1024)
+def _prepared_form(query: str) -> tuple[str, str, tuple[str, ...]]:
+    """
+    Name a %s or %(name)s-style statement after its text and number its placeholders.
+
+    Every distinct %(name)s placeholder gets one number, however often it is
+    used in the statement.
+
+    Args:
+        query (str): SQL using %s or %(name)s placeholders
+
+    Returns:
+        tuple: (statement name, SQL using $1, $2, ... placeholders, names of
+            the %(name)s placeholders in number order)
+    """
+    numbers = count(1)
+    names = {}
+
+    def number(m):
+        if m.group() == "%%":
+            return "%"
+        if m.group(1) is None:
+            return f"${next(numbers)}"
+        if m.group(1) not in names:
+            names[m.group(1)] = next(numbers)
+        return f"${names[m.group(1)]}"
+
+    prepared_query = re.sub(r"%%|%(?:\((\w+)\))?s", number, query)
+    digest = hashlib.blake2b(query.encode(), digest_size=8).hexdigest()
+    return f"s_{digest}", prepared_query, tuple(names)
+
+
+@functools.lru_cache(maxsize=1024)
+def _execute_statement(name: str, n_params: int) -> str:
+    """
+    Build the EXECUTE statement of a prepared statement once per parameter count.
+
+    Args:
+        name (str): Name of the prepared statement
+        n_params (int): Number of parameters it takes
+
+    Returns:
+        str: EXECUTE statement with a %s placeholder per parameter
+    """
+    if not n_params:
+        return f"EXECUTE {name}"
+    return f"EXECUTE {name} ({', '.join(['%s'] * n_params)})"
+
 
 class BaseManager:
     """Base class with common connection methods"""
 
     @staticmethod
-    def get_connection():
-        """Get a connection from the pool"""
-        return pool.getconn()
+    def get_connection(readonly: bool = False):
+        """Get a connection from the pool, or from the read-only pool if readonly"""
+        return get_pool(readonly).getconn()
 
     @staticmethod
     def release_connection(conn):
-        """Release a connection back to the pool"""
-        pool.putconn(conn)
+        """Release a connection back to the pool it came from"""
+        get_pool(isinstance(conn, ReadOnlyConnection)).putconn(conn)
+
+    @contextmanager
+    def _borrow(self, readonly: bool = False):
+        """
+        Borrow a pooled connection for the duration of the block.
+
+        Like _session, for blocks that open their own cursors such as named
+        server-side cursors.
+
+        Args:
+            readonly (bool, optional): Borrow from the read-only pool. Defaults to False.
+
+        Yields:
+            connection: The borrowed connection
+        """
+        conn = self.get_connection(readonly)
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @contextmanager
+    def _session(self, readonly: bool = False, row_class: type = None):
+        """
+        Borrow a pooled connection together with a cursor on it.
+
+        The transaction is rolled back if the block raises, and the connection
+        is always released, including on early return.
+
+        Args:
+            readonly (bool, optional): Borrow from the read-only pool. Defaults to False.
+            row_class (type, optional): Return rows as instances of this class,
+                see ObjectCursor. Defaults to plain tuples.
+
+        Yields:
+            tuple: (connection, cursor)
+        """
+        cursor_factory = object_cursor(row_class) if row_class is not None else None
+        conn = self.get_connection(readonly)
+        try:
+            yield conn, conn.reusable_cursor(cursor_factory)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @staticmethod
+    def execute_prepared(cursor, name: str, query: str, params: tuple = ()):
+        """
+        Execute a statement that is prepared once per connection.
+
+        The first call on a connection sends PREPARE, later calls only send
+        EXECUTE so the server skips parsing and planning.
+
+        Args:
+            cursor: Cursor of a pooled connection
+            name (str): Name of the prepared statement
+            query (str): SQL using $1, $2, ... placeholders
+            params (tuple, optional): Values for the placeholders
+        """
+        prepared = cursor.connection.prepared_statements
+        if name in prepared:
+            prepared.move_to_end(name)
+        else:
+            cursor.execute(f"PREPARE {name} AS {query}")
+            prepared[name] = None
+            if len(prepared) > PREPARED_MAX:
+                stale, _ = prepared.popitem(last=False)
+                cursor.execute(f"DEALLOCATE {stale}")
+        cursor.execute(_execute_statement(name, len(params)), params or None)
+
+    @staticmethod
+    def execute_cached(cursor, query: str, params: tuple | dict = ()):
+        """
+        Execute a statement prepared under a name derived from its SQL text.
+
+        Lets literal %s-style SQL share the per-connection statement cache of
+        execute_prepared without naming every statement by hand. A statement
+        is only prepared once the connection ran it PREPARE_THRESHOLD times,
+        until then it is executed as is.
+
+        Args:
+            cursor: Cursor of a pooled connection
+            query (str): SQL using %s placeholders, or %(name)s placeholders
+            params (tuple | dict, optional): Values for the placeholders, a
+                dict for %(name)s placeholders
+        """
+        name, prepared_query, param_names = _prepared_form(query)
+        conn = cursor.connection
+        if name not in conn.prepared_statements:
+            uses = conn.statement_uses.get(name, 0) + 1
+            if uses < PREPARE_THRESHOLD:
+                conn.statement_uses[name] = uses
+                cursor.execute(query, params)
+                return
+            conn.statement_uses.pop(name, None)
+        if param_names:
+            params = tuple(params[param] for param in param_names)
+        BaseManager.execute_prepared(cursor, name, prepared_query, params)
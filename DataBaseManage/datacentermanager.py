@@ -1,12 +1,60 @@
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
 from utils.schema import DataCenter, SimpleDataCenter, SimpleRoom
 from DataBaseManage.connection import BaseManager
+from DataBaseManage.cache import cached_query, invalidates_cache
+
+# Statement of getDatacenter, prepared once per connection. Rooms are
+# aggregated into a JSON array in the same row, each room as an array of its
+# columns in SimpleRoom field order. Rack and host counts come from one
+# grouped scan of the datacenter's racks and hosts each.
+_GET_DATACENTER = """
+    SELECT d.name, d.height,
+        COALESCE(
+            json_agg(
+                json_build_array(
+                    r.name, r.height, COALESCE(ra.n_racks, 0),
+                    COALESCE(h.n_hosts, 0), r.dc_name
+                )
+                ORDER BY r.name
+            ) FILTER (WHERE r.name IS NOT NULL),
+            '[]'
+        ) AS rooms
+    FROM datacenters d
+    LEFT JOIN rooms r ON r.dc_name = d.name
+    LEFT JOIN (
+        SELECT room_name, COUNT(*) AS n_racks FROM racks
+        WHERE dc_name = $1 GROUP BY room_name
+    ) ra ON ra.room_name = r.name
+    LEFT JOIN (
+        SELECT room_name, COUNT(*) AS n_hosts FROM hosts
+        WHERE dc_name = $1 GROUP BY room_name
+    ) h ON h.room_name = r.name
+    WHERE d.name = $1
+    GROUP BY d.name
+"""
+
+# SET clause of each optional updateDatacenter field, in bit order of the update mask
+_UPDATE_DATACENTER_FIELDS = ("name = %s", "height = %s")
+
+# Precomputed UPDATE statement for every combination of updated fields,
+# keyed by the bitmap built in updateDatacenter
+_UPDATE_DATACENTER_QUERIES = {
+    mask: "UPDATE datacenters SET "
+    + ", ".join(
+        part
+        for bit, part in enumerate(_UPDATE_DATACENTER_FIELDS)
+        if mask >> bit & 1
+    )
+    + ", updated_at = CURRENT_TIMESTAMP WHERE name = %s RETURNING name"
+    for mask in range(1, 1 << len(_UPDATE_DATACENTER_FIELDS))
+}
 
 
 class DatacenterManager(BaseManager):
     """Class for managing datacenter operations"""
 
     # Datacenter operations
+    @invalidates_cache
     def createDatacenter(
         self,
         name: str,
@@ -23,118 +71,106 @@ class DatacenterManager(BaseManager):
             DataCenter: A DataCenter object representing the newly created datacenter.
             None: If creation fails
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # Insert the new datacenter
-                cursor.execute(
-                    """
-                    INSERT INTO datacenters (name, height)
-                    VALUES (%s, %s)
-                    RETURNING name, height
-                    """,
-                    (name, default_height),
-                )
-
-                # Commit the transaction
-                conn.commit()
-
-                # Get the newly created datacenter data
-                new_datacenter = cursor.fetchone()
+        with self._session() as (conn, cursor):
+            # Insert the new datacenter
+            self.execute_cached(
+                cursor,
+                """
+                INSERT INTO datacenters (name, height)
+                VALUES (%s, %s)
+                RETURNING name, height
+                """,
+                (name, default_height),
+            )
+
+            # Commit the transaction
+            conn.commit()
+
+            # Get the newly created datacenter data
+            new_datacenter = cursor.fetchone()
+
+            if not new_datacenter:
+                return None
+
+            # Create and return a DataCenter object
+            return DataCenter(
+                name=new_datacenter[0],
+                height=new_datacenter[1],
+                rooms=[],
+                n_rooms=0,  # New datacenter has no rooms yet
+                n_racks=0,  # New datacenter has no racks yet
+                n_hosts=0,  # New datacenter has no hosts yet
+            )
+
+    @invalidates_cache
+    def createDatacenters(
+        self, datacenters: list[tuple[str, int]]
+    ) -> list[DataCenter]:
+        """
+        Create several datacenters with a single INSERT.
 
-                if not new_datacenter:
-                    return None
+        Args:
+            datacenters (list[tuple[str, int]]): (name, default_height) of each
+                datacenter to create
 
-                # Create and return a DataCenter object
-                return DataCenter(
-                    name=new_datacenter["name"],
-                    height=new_datacenter["height"],
+        Returns:
+            list[DataCenter]: The created datacenters
+        """
+        if not datacenters:
+            return []
+
+        with self._session() as (conn, cursor):
+            rows = execute_values(
+                cursor,
+                "INSERT INTO datacenters (name, height) VALUES %s RETURNING name, height",
+                datacenters,
+                page_size=len(datacenters),
+                fetch=True,
+            )
+            conn.commit()
+
+            return [
+                DataCenter(
+                    name=name,
+                    height=height,
                     rooms=[],
-                    n_rooms=0,  # New datacenter has no rooms yet
-                    n_racks=0,  # New datacenter has no racks yet
-                    n_hosts=0,  # New datacenter has no hosts yet
+                    n_rooms=0,
+                    n_racks=0,
+                    n_hosts=0,
                 )
+                for name, height in rows
+            ]
 
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
-
+    @cached_query
     def getDatacenter(self, datacenter_name: str) -> DataCenter | None:
         """
         Get datacenters information.
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # Get the specific datacenter
-                cursor.execute(
-                    "SELECT * FROM datacenters WHERE name = %s", (datacenter_name,)
-                )
-                data = cursor.fetchone()
-                if not data:
-                    return None
-
-                # Get rooms for this datacenter
-                cursor.execute(
-                    "SELECT * FROM rooms WHERE dc_name = %s", (datacenter_name,)
-                )
-                rooms_data = cursor.fetchall()
-
-                # Convert to SimpleRoom objects
-                rooms = []
-                all_racks_num = 0
-                all_hosts_num = 0
-                for room_data in rooms_data:
-                    room_name = room_data["name"]
-                    room_height = room_data["height"]
-                    # count racks in this room
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM racks WHERE room_name = %s", (room_name,)
-                    )
-                    result = cursor.fetchone()
-                    n_racks = result["count"] if result else 0
-                    # count hosts in this room
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM hosts WHERE room_name = %s", (room_name,)
-                    )
-                    result = cursor.fetchone()
-                    n_hosts = result["count"] if result else 0
-                    # Create SimpleRoom object
-                    rooms.append(
-                        SimpleRoom(
-                            name=room_name,
-                            height=room_height,
-                            n_racks=n_racks,
-                            n_hosts=n_hosts,
-                            dc_name=datacenter_name,
-                        )
-                    )
-                    all_racks_num += n_racks
-                    all_hosts_num += n_hosts
-
-                # Create and return a DataCenter object
-                return DataCenter(
-                    name=data["name"],
-                    height=data["height"],
-                    rooms=rooms,
-                    n_rooms=len(rooms),
-                    n_racks=all_racks_num,
-                    n_hosts=all_hosts_num,
-                )
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
-
+        with self._session(readonly=True) as (conn, cursor):
+            # Get the datacenter together with its rooms
+            self.execute_prepared(
+                cursor, "get_datacenter", _GET_DATACENTER, (datacenter_name,)
+            )
+            data = cursor.fetchone()
+            if not data:
+                return None
+
+            # Convert to SimpleRoom objects
+            rooms = [SimpleRoom(*room_data) for room_data in data[2]]
+            all_racks_num = sum(room.n_racks for room in rooms)
+            all_hosts_num = sum(room.n_hosts for room in rooms)
+
+            # Create and return a DataCenter object
+            return DataCenter(
+                name=data[0],
+                height=data[1],
+                rooms=rooms,
+                n_rooms=len(rooms),
+                n_racks=all_racks_num,
+                n_hosts=all_hosts_num,
+            )
+
+    @cached_query
     def getAllDatacenters(self) -> list[SimpleDataCenter]:
         """
         Get all datacenters.
@@ -142,65 +178,26 @@ class DatacenterManager(BaseManager):
         Returns:
             list: List of DataCenter objects
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT * FROM datacenters ORDER BY name")
-                datacenters_data = cursor.fetchall()
-
-                # Create a list to store DataCenter objects
-                datacenters = []
-
-                # Process each datacenter
-                for data in datacenters_data:
-                    datacenter_name = data["name"]
-                    # Get rooms for this datacenter
-                    cursor.execute(
-                        "SELECT * FROM rooms WHERE dc_name = %s", (datacenter_name,)
-                    )
-                    # Count the number of rooms
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM rooms WHERE dc_name = %s",
-                        (datacenter_name,),
-                    )
-                    result = cursor.fetchone()
-                    n_rooms = result["count"] if result else 0
-                    # Count the number of racks
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM racks WHERE dc_name = %s",
-                        (datacenter_name,),
-                    )
-                    result = cursor.fetchone()
-                    n_racks = result["count"] if result else 0
-                    # Count the number of hosts
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM hosts WHERE dc_name = %s",
-                        (datacenter_name,),
-                    )
-                    result = cursor.fetchone()
-                    n_hosts = result["count"] if result else 0
-                    # Create DataCenter object and append to list
-                    datacenters.append(
-                        SimpleDataCenter(
-                            name=data["name"],
-                            height=data["height"],
-                            n_rooms=n_rooms,
-                            n_racks=n_racks,
-                            n_hosts=n_hosts,
-                        )
-                    )
-
-                return datacenters
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
-
+        # Rows are returned as SimpleDataCenter objects, columns are selected
+        # in SimpleDataCenter field order
+        with self._session(readonly=True, row_class=SimpleDataCenter) as (
+            conn,
+            cursor,
+        ):
+            # Fetch every datacenter together with its room, rack and host
+            # counts from the datacenter_counts view in one query
+            self.execute_cached(
+                cursor,
+                """
+                SELECT name, height, n_rooms, n_racks, n_hosts
+                FROM datacenter_counts
+                ORDER BY name
+                """
+            )
+
+            return cursor.fetchall()
+
+    @invalidates_cache
     def updateDatacenter(
         self,
         old_name: str,
@@ -218,50 +215,29 @@ class DatacenterManager(BaseManager):
         Returns:
             bool: True if datacenter was successfully updated, False if not found
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # First check if datacenter exists
-                cursor.execute("SELECT * FROM datacenters WHERE name = %s", (old_name,))
-                if cursor.fetchone() is None:
-                    return False
-
-                # Prepare update query parts
-                query_parts = []
-                update_params = []
-
-                if new_name is not None:
-                    query_parts.append("name = %s")
-                    update_params.append(new_name)
-
-                if default_height is not None:
-                    query_parts.append("height = %s")
-                    update_params.append(default_height)
-
-                # If no database updates requested but ip_ranges provided,
-                # we'll still need to process IP ranges
-                if query_parts:
-                    # Add updated_at to be updated
-                    query_parts.append("updated_at = CURRENT_TIMESTAMP")
-
-                    # Build and execute update query
-                    query = f"UPDATE datacenters SET {', '.join(query_parts)} WHERE name = %s"
-                    update_params.append(old_name)
-
-                    cursor.execute(query, update_params)
-                    conn.commit()
-
-                return True
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session() as (conn, cursor):
+            mask = (new_name is not None) | (default_height is not None) << 1
+            if not mask:
+                # Nothing to update, only report whether the datacenter exists
+                self.execute_cached(
+                    cursor,
+                    "SELECT 1 FROM datacenters WHERE name = %s", (old_name,)
+                )
+                return cursor.fetchone() is not None
+
+            update_params = [v for v in (new_name, default_height) if v is not None]
+            update_params.append(old_name)
 
+            # RETURNING tells whether the datacenter existed
+            self.execute_cached(
+                cursor, _UPDATE_DATACENTER_QUERIES[mask], tuple(update_params)
+            )
+            updated = cursor.fetchone()
+            conn.commit()
+
+            return updated is not None
+
+    @invalidates_cache
     def deleteDatacenter(self, datacenter_name: str) -> bool:
         """
         Delete a datacenter from the database.
@@ -271,31 +247,24 @@ class DatacenterManager(BaseManager):
 
         Returns:
             bool: True if datacenter was successfully deleted, False if not found
+                or it still has rooms
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # First check if datacenter exists
-                cursor.execute(
-                    "SELECT name FROM datacenters WHERE name = %s", (datacenter_name,)
-                )
-                if cursor.fetchone() is None:
-                    return False
-
-                # Delete the datacenter
-                cursor.execute(
-                    "DELETE FROM datacenters WHERE name = %s", (datacenter_name,)
-                )
-                conn.commit()
-
-                # Check if any rows were affected
-                return cursor.rowcount > 0
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session() as (conn, cursor):
+            # Delete the datacenter, no affected row means it does not exist
+            # or still has rooms
+            self.execute_cached(
+                cursor,
+                """
+                DELETE FROM datacenters WHERE name = %s
+                AND NOT EXISTS (SELECT 1 FROM rooms WHERE dc_name = %s)
+                """,
+                (datacenter_name, datacenter_name),
+            )
+            deleted = cursor.rowcount > 0
+            conn.commit()
+
+            return deleted
+
+
+# Shared instance used by the blueprints
+dc_manager = DatacenterManager()
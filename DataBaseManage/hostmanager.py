@@ -1,6 +1,142 @@
+import csv
+import io
+from collections.abc import Iterable, Iterator
 from utils.schema import Host
-from DataBaseManage.connection import BaseManager
-from psycopg2.extras import RealDictCursor
+from DataBaseManage.connection import BaseManager, object_cursor
+from DataBaseManage.cache import cached_query, invalidates_cache
+from psycopg2.errors import UniqueViolation
+from psycopg2.extras import execute_values
+
+# Host columns in the field order of the Host dataclass, so a selected row
+# can be passed positionally as Host(*row)
+_HOST_COLUMNS = "name, height, ip, running, service_name, dc_name, room_name, rack_name, pos"
+
+# Cursor class returning rows of _HOST_COLUMNS as Host objects
+_HostCursor = object_cursor(Host)
+
+# Statement of getHost, prepared once per connection
+_GET_HOST = "SELECT " + _HOST_COLUMNS + " FROM hosts WHERE name = $1"
+
+# SET clause of each optional updateHost field, in bit order of the update mask.
+# Moving a host only sets its rack, the hosts_sync_location trigger sets the
+# room and datacenter of the new rack. The position is only changed together
+# with the rack. A stopped host gives its IP back, a started host without an
+# IP claims a free one of its service.
+_UPDATE_HOST_FIELDS = (
+    "name = %(new_name)s",
+    "height = %(new_height)s",
+    "rack_name = %(new_rack_name)s",
+    "pos = %(new_pos)s",
+    "running = FALSE, ip = NULL",
+    "running = TRUE, ip = COALESCE(old.ip, (SELECT ip FROM claimed))",
+)
+
+# Locks the host, releases or claims its IP and updates it in a single
+# statement. No row is returned if the host or the rack to move to does not
+# exist.
+_UPDATE_HOST = """
+    WITH old AS (
+        SELECT name, ip, service_name FROM hosts
+        WHERE name = %(host_name)s
+            AND (
+                %(new_rack_name)s::text IS NULL
+                OR EXISTS (SELECT 1 FROM racks WHERE name = %(new_rack_name)s)
+            )
+        FOR UPDATE
+    ), released AS (
+        UPDATE IPs SET assigned = FALSE
+        FROM old
+        WHERE %(new_running)s IS FALSE AND IPs.ip = old.ip
+    ), claimed AS (
+        UPDATE IPs SET assigned = TRUE
+        WHERE ip = (
+            SELECT IPs.ip FROM IPs
+            JOIN old ON IPs.service_name = old.service_name
+            WHERE %(new_running)s IS TRUE
+                AND old.ip IS NULL
+                AND IPs.assigned = FALSE
+            ORDER BY IPs.ip DESC
+            LIMIT 1
+            FOR UPDATE OF IPs SKIP LOCKED
+        )
+        RETURNING ip
+    )
+    UPDATE hosts SET {set}
+    FROM old
+    WHERE hosts.name = old.name
+    RETURNING hosts.ip
+"""
+
+# Precomputed _UPDATE_HOST statement for every combination of updated fields,
+# keyed by the bitmap built in updateHost
+_UPDATE_HOST_QUERIES = {
+    mask: _UPDATE_HOST.format(
+        set=", ".join(
+            part for bit, part in enumerate(_UPDATE_HOST_FIELDS) if mask >> bit & 1
+        )
+    )
+    for mask in range(1, 1 << len(_UPDATE_HOST_FIELDS))
+}
+
+# Inserts the hosts listed in {source} (name, height, rack_name, pos, ord).
+# The new hosts are numbered per service and the n-th host is paired with
+# the n-th free IP of that service, then those IPs are claimed and the hosts
+# inserted in the same statement. Hosts whose rack does not exist are skipped.
+_INSERT_HOSTS = """
+    WITH new AS (
+        SELECT v.name, v.height, v.pos, r.name AS rack_name,
+            r.service_name, r.dc_name, r.room_name,
+            row_number() OVER (
+                PARTITION BY r.service_name ORDER BY v.ord
+            ) AS n
+        FROM {source}
+        JOIN racks r ON r.name = v.rack_name
+    ), free AS (
+        SELECT ip, service_name,
+            row_number() OVER (
+                PARTITION BY service_name ORDER BY ip DESC
+            ) AS n
+        FROM IPs
+        WHERE assigned = FALSE
+            AND service_name IN (SELECT service_name FROM new)
+    ), claimed AS (
+        UPDATE IPs SET assigned = TRUE
+        FROM new
+        JOIN free ON free.service_name = new.service_name
+            AND free.n = new.n
+        WHERE IPs.ip = free.ip AND IPs.assigned = FALSE
+        RETURNING IPs.ip, new.name AS host_name
+    )
+    INSERT INTO hosts (name, height, ip, running, service_name, dc_name, room_name, rack_name, pos)
+    SELECT new.name, new.height, claimed.ip, claimed.ip IS NOT NULL,
+        new.service_name, new.dc_name, new.room_name, new.rack_name, new.pos
+    FROM new LEFT JOIN claimed ON claimed.host_name = new.name
+"""
+
+
+class _CsvStream:
+    """Read-only file object producing COPY csv data from rows as it is read"""
+
+    def __init__(self, rows: Iterable[tuple]):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+
+    def read(self, size: int = -1) -> str:
+        # Format rows only until the requested amount of data is available
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
 
 
 # Todo
@@ -8,6 +144,7 @@ from psycopg2.extras import RealDictCursor
 class HostManager(BaseManager):
 
     # CREATE operations
+    @invalidates_cache
     def createHost(self, name: str, height: int, rack_name: str, pos: int) -> Host:
         """
         Create a new host in a rack.
@@ -21,77 +158,122 @@ class HostManager(BaseManager):
         Returns:
             Host: Host object created
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # Check if rack exists
-                cursor.execute(
-                    "SELECT name, service_name, dc_name, room_name FROM racks WHERE name = %s",
-                    (rack_name,),
-                )
-                rack_data = cursor.fetchone()
-                if rack_data is None:
-                    return None
-
-                # Get an available IP of service
-                cursor.execute(
-                    "SELECT ip FROM IPs WHERE service_name = %s AND assigned = FALSE ORDER BY ip DESC LIMIT 1",
-                    (rack_data["service_name"],),
-                )
-                allocated_ip = cursor.fetchone()
-                if allocated_ip is not None:
-                    ip_value = allocated_ip["ip"]
-                    # Update the IP to be assigned
-                    cursor.execute(
-                        "UPDATE IPs SET assigned = TRUE WHERE ip = %s",
-                        (ip_value,),
+        with self._session(row_class=Host) as (conn, cursor):
+            # Look up the rack, claim a free IP of its service and insert the
+            # host in one statement. No row is returned if the rack does not
+            # exist; the host is created stopped without IP if none is free.
+            # A taken position is reported by the unique constraint, so it is
+            # not checked with a query beforehand
+            try:
+                self.execute_cached(
+                    cursor,
+                    """
+                    WITH rack AS (
+                        SELECT name, service_name, dc_name, room_name
+                        FROM racks WHERE name = %s
+                    ), ip AS (
+                        UPDATE IPs SET assigned = TRUE
+                        WHERE ip = (
+                            SELECT ip FROM IPs
+                            WHERE service_name = (SELECT service_name FROM rack)
+                                AND assigned = FALSE
+                            ORDER BY ip DESC LIMIT 1
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING ip
                     )
-                    running = True
-                else:
-                    ip_value = None
-                    running = False  
-
-                new_host = Host(
-                    name=name,
-                    height=height,
-                    ip=ip_value,
-                    running=running,
-                    service_name=rack_data["service_name"],
-                    dc_name=rack_data["dc_name"],
-                    room_name=rack_data["room_name"],
-                    rack_name=rack_data["name"],
-                    pos=pos,
+                    INSERT INTO hosts (name, height, ip, running, service_name, dc_name, room_name, rack_name, pos)
+                    SELECT %s, %s, ip.ip, ip.ip IS NOT NULL,
+                        rack.service_name, rack.dc_name, rack.room_name, rack.name, %s
+                    FROM rack LEFT JOIN ip ON TRUE
+                    RETURNING """
+                    + _HOST_COLUMNS,
+                    (rack_name, name, height, pos),
                 )
+            except UniqueViolation as e:
+                if e.diag.constraint_name == "unique_rack_position":
+                    raise ValueError(f"Position {pos} of rack {rack_name} is already taken")
+                raise
+            host = cursor.fetchone()
+            if host is None:
+                return None
+            conn.commit()
+
+            return host
+
+    @invalidates_cache
+    def createHosts(self, hosts: list[tuple[str, int, str, int]]) -> list[Host]:
+        """
+        Create several hosts with a single INSERT.
 
-                # Insert host
-                cursor.execute(
-                    "INSERT INTO hosts (name, height, ip, running, service_name, dc_name, room_name, rack_name, pos) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                    (
-                        new_host.name,
-                        new_host.height,
-                        new_host.ip,
-                        new_host.running,
-                        new_host.service_name,
-                        new_host.dc_name,
-                        new_host.room_name,
-                        new_host.rack_name,
-                        new_host.pos,
-                    ),
+        Each host claims its own free IP of its rack's service, like createHost.
+
+        Args:
+            hosts (list[tuple[str, int, str, int]]): (name, height, rack_name, pos)
+                of each host to create
+
+        Returns:
+            list[Host]: The created hosts. Hosts whose rack does not exist are skipped.
+        """
+        if not hosts:
+            return []
+
+        with self._session(row_class=Host) as (conn, cursor):
+            created = execute_values(
+                cursor,
+                _INSERT_HOSTS.format(
+                    source="(VALUES %s) AS v(name, height, rack_name, pos, ord)"
                 )
-                conn.commit()
+                + " RETURNING " + _HOST_COLUMNS,
+                [(*host, i) for i, host in enumerate(hosts)],
+                template="(%s, %s::int, %s, %s::int, %s::int)",
+                page_size=len(hosts),
+                fetch=True,
+            )
+            conn.commit()
+
+            return created
+
+    @invalidates_cache
+    def importHosts(self, hosts: Iterable[tuple[str, int, str, int]]) -> int:
+        """
+        Bulk load hosts, e.g. when importing a datacenter inventory.
 
-                return new_host
+        The rows are streamed to the database with COPY into a temporary table
+        and inserted from there like createHosts, so any number of hosts takes
+        two statements and is never held in memory as a whole.
+
+        Args:
+            hosts (Iterable[tuple[str, int, str, int]]): (name, height, rack_name, pos)
+                of each host to create
 
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        Returns:
+            int: Number of hosts created. Hosts whose rack does not exist are skipped.
+        """
+        with self._session() as (conn, cursor):
+            cursor.execute(
+                """
+                CREATE TEMP TABLE host_import (
+                    name VARCHAR(255),
+                    height INTEGER,
+                    rack_name VARCHAR(255),
+                    pos INTEGER,
+                    ord BIGINT GENERATED ALWAYS AS IDENTITY
+                ) ON COMMIT DROP
+                """
+            )
+            cursor.copy_expert(
+                "COPY host_import (name, height, rack_name, pos) FROM STDIN WITH (FORMAT csv)",
+                _CsvStream(hosts),
+            )
+            cursor.execute(_INSERT_HOSTS.format(source="host_import AS v"))
+            created = cursor.rowcount
+            conn.commit()
+
+            return created
 
     # READ operations
+    @cached_query
     def getHost(self, host_name: str) -> Host | None:
         """
         Get a host by name.
@@ -102,77 +284,35 @@ class HostManager(BaseManager):
         Returns:
             Host: Host object if found, None otherwise
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT * FROM hosts WHERE name = %s",
-                    (host_name,),
-                )
-                result = cursor.fetchone()
-
-                if result is None:
-                    return None
-
-                # Create and return the Host object
-                return Host(
-                    name=result["name"],
-                    height=result["height"],
-                    ip=result["ip"],
-                    running=result["running"],
-                    service_name=result["service_name"],
-                    dc_name=result["dc_name"],
-                    room_name=result["room_name"],
-                    rack_name=result["rack_name"],
-                    pos=result["pos"],
-                )
-        except Exception as e:
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session(readonly=True, row_class=Host) as (conn, cursor):
+            self.execute_prepared(cursor, "get_host", _GET_HOST, (host_name,))
+            return cursor.fetchone()
 
-    def getAllHosts(self) -> list[Host]:
+    def getAllHosts(self, batch: int = 500) -> Iterator[Host]:
         """
-        Get all hosts.
+        Get all hosts without loading them all into memory.
+
+        Rows are read through a server-side cursor, `batch` rows per round trip.
+        The connection is held until the iterator is exhausted or closed, use
+        list() to get every host at once.
 
         Args:
-            None
+            batch (int, optional): Number of rows fetched per round trip. Defaults to 500.
 
-        Returns:
-            list[Host]: List of all Host objects
+        Yields:
+            Host: Each host, ordered by name
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("SELECT * FROM hosts ORDER BY name")
-                results = cursor.fetchall()
-                hosts = []
-                for result in results:
-                    hosts.append(Host(
-                        name=result["name"],
-                        height=result["height"],
-                        ip=result["ip"],
-                        running=result["running"],
-                        service_name=result["service_name"],
-                        dc_name=result["dc_name"],
-                        room_name=result["room_name"],
-                        rack_name=result["rack_name"],
-                        pos=result["pos"],
-                    ))
-                return hosts
-
-
-
-        except Exception as e:
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        # Named cursors need a transaction, it is rolled back when the pool
+        # gets the connection back
+        with self._borrow() as conn, conn.cursor(
+            name="all_hosts", cursor_factory=_HostCursor
+        ) as cursor:
+            cursor.itersize = batch
+            cursor.execute("SELECT " + _HOST_COLUMNS + " FROM hosts ORDER BY name")
+            yield from cursor
 
     # UPDATE operations
+    @invalidates_cache
     def updateHost(
         self,
         host_name: str,
@@ -196,127 +336,45 @@ class HostManager(BaseManager):
         Returns:
             bool
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # First check if host exists and get its current information
-                cursor.execute(
-                    "SELECT name, rack_name, room_name, dc_name, ip, service_name FROM hosts WHERE name = %s",
-                    (host_name,),
+        with self._session() as (conn, cursor):
+            mask = (
+                (new_name is not None)
+                | (new_height is not None) << 1
+                | (new_rack_name is not None) << 2
+                | (new_rack_name is not None and new_pos is not None) << 3
+                | (new_running is False) << 4
+                | (new_running is True) << 5
+            )
+            if not mask:
+                # Nothing to update, only report whether the host exists
+                self.execute_cached(
+                    cursor, "SELECT 1 FROM hosts WHERE name = %s", (host_name,)
                 )
-                host_data = cursor.fetchone()
-
-                if host_data is None:
-                    return False
-
-                current_rack_name = host_data["rack_name"]
-                current_room_name = host_data["room_name"]
-                current_dc_name   = host_data["dc_name"]
-
-                # Check if rack to be move to exists
-                new_room_name = None
-                if new_rack_name is not None:
-                    cursor.execute(
-                        "SELECT name, room_name, dc_name FROM racks WHERE name = %s",
-                        (new_rack_name,),
-                    )
-                    new_rack_data = cursor.fetchone()
-
-                    if new_rack_data is None:
-                        return False
-
-                    new_room_name = new_rack_data["room_name"]
-                    new_dc_name   = new_rack_data["dc_name"]
-                    print(new_rack_data)
-
-                # Build the update query based on provided parameters
-                update_params = []
-                query_parts = []
-
-                if new_name is not None:
-                    query_parts.append("name = %s")
-                    update_params.append(new_name)
-
-                if new_height is not None:
-                    query_parts.append("height = %s")
-                    update_params.append(new_height)
-
-                if new_running is not None:
-                    query_parts.append("running = %s")
-                    update_params.append(new_running)
-
-                if new_rack_name is not None:
-                    if new_rack_name != current_rack_name:
-                        query_parts.append("rack_name = %s")
-                        update_params.append(new_rack_name)
-
-                    if new_room_name != current_room_name:
-                        query_parts.append("room_name = %s")
-                        update_params.append(new_room_name)
-
-                    if new_dc_name != current_dc_name:
-                        query_parts.append("dc_name = %s")
-                        update_params.append(new_dc_name)
-                    if new_pos is not None:
-                        query_parts.append("pos = %s")
-                        update_params.append(new_pos)
-
-                if not query_parts:
-                    # Nothing to update
-                    return True
-
-                query = f"UPDATE hosts SET {', '.join(query_parts)} WHERE name = %s"
-                update_params.append(host_name)
-
-                cursor.execute(query, tuple(update_params))
-                # if new_running is False, we need to mark the IP as unassigned
-                if new_running is False and host_data["ip"] is not None:
-                    cursor.execute(
-                        "UPDATE IPs SET assigned = FALSE WHERE ip = %s",
-                        (host_data["ip"],),
-                    )
-                    host_data["ip"] = None  # Clear the IP in host data
-                    cursor.execute(
-                        "UPDATE hosts SET ip = NULL WHERE name = %s",
-                        (host_name,),
-                    )
-                elif new_running is True and host_data["ip"] is None:
-                    # If the host is being set to running and has no IP, allocate a new one
-                    cursor.execute(
-                        "SELECT ip FROM IPs WHERE service_name = %s AND assigned = FALSE ORDER BY ip DESC LIMIT 1",
-                        (host_data["service_name"],),
-                    )
-                    allocated_ip = cursor.fetchone()
-                    if allocated_ip is not None:
-                        new_ip_value = allocated_ip["ip"]
-                        # Update the IP to be assigned
-                        cursor.execute(
-                            "UPDATE IPs SET assigned = TRUE WHERE ip = %s",
-                            (new_ip_value,),
-                        )
-                        # Update the host's IP
-                        cursor.execute(
-                            "UPDATE hosts SET ip = %s WHERE name = %s",
-                            (new_ip_value, host_name),
-                        )
-                    else:
-                        raise ValueError("No available IPs for the service")
-
-                conn.commit()
-
-                # Check if any rows were affected
-                return cursor.rowcount > 0
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+                return cursor.fetchone() is not None
+
+            self.execute_cached(
+                cursor,
+                _UPDATE_HOST_QUERIES[mask],
+                {
+                    "host_name": host_name,
+                    "new_name": new_name,
+                    "new_height": new_height,
+                    "new_running": new_running,
+                    "new_rack_name": new_rack_name,
+                    "new_pos": new_pos,
+                },
+            )
+            result = cursor.fetchone()
+            if result is None:
+                return False
+            if new_running is True and result[0] is None:
+                raise ValueError("No available IPs for the service")
+
+            conn.commit()
+            return True
 
     # DELETE operations
+    @invalidates_cache
     def deleteHost(self, host_name: str) -> bool:
         """
         Delete a host from the database.
@@ -327,38 +385,27 @@ class HostManager(BaseManager):
         Returns:
             bool: True if host was successfully deleted, False if not found
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # First check if host exists
-                cursor.execute(
-                    "SELECT name, rack_name, room_name, dc_name, ip FROM hosts WHERE name = %s",
-                    (host_name,),
+        with self._session() as (conn, cursor):
+            # Delete the host and give its IP back in one statement, the
+            # deleted row doubles as the existence check
+            self.execute_cached(
+                cursor,
+                """
+                WITH deleted AS (
+                    DELETE FROM hosts WHERE name = %s RETURNING ip
+                ), released AS (
+                    UPDATE IPs SET assigned = FALSE
+                    FROM deleted
+                    WHERE IPs.ip = deleted.ip
                 )
-                host_data = cursor.fetchone()
+                SELECT 1 FROM deleted
+                """,
+                (host_name,),
+            )
+            deleted = cursor.fetchone() is not None
+            conn.commit()
 
-                if host_data is None:
-                    return False
+            return deleted
 
-                # Delete the host
-                cursor.execute("DELETE FROM hosts WHERE name = %s", (host_name,))
-
-                # If the host had an IP, mark it as unassigned
-                if host_data["ip"] is not None:
-                    cursor.execute(
-                        "UPDATE IPs SET assigned = FALSE WHERE ip = %s",
-                        (host_data["ip"],),
-                    )
-                conn.commit()
-
-                # Check if any rows were affected
-                return cursor.rowcount > 0
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+# Shared instance used by the blueprints
+host_manager = HostManager()
@@ -1,12 +1,59 @@
 import os
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
 from utils.schema import Rack, Host
 from DataBaseManage.connection import BaseManager
-
+from DataBaseManage.cache import cached_query, invalidates_cache
+
+# SET clause of each optional updateRack field, in bit order of the update mask.
+# Moving a rack takes its dc_name from the new room joined in the same UPDATE.
+_UPDATE_RACK_FIELDS = (
+    "name = %s",
+    "height = %s",
+    "room_name = rooms.name, dc_name = rooms.dc_name",
+)
+_UPDATE_RACK_ROOM_BIT = 1 << 2
+
+# Precomputed UPDATE statement for every combination of updated fields,
+# keyed by the bitmap built in updateRack. No row is updated if the rack or
+# the new room does not exist.
+_UPDATE_RACK_QUERIES = {
+    mask: "UPDATE racks SET "
+    + ", ".join(
+        part for bit, part in enumerate(_UPDATE_RACK_FIELDS) if mask >> bit & 1
+    )
+    + (
+        " FROM rooms WHERE racks.name = %s AND rooms.name = %s"
+        if mask & _UPDATE_RACK_ROOM_BIT
+        else " WHERE name = %s"
+    )
+    for mask in range(1, 1 << len(_UPDATE_RACK_FIELDS))
+}
+
+# Statement of getRack, prepared once per connection. The rack's hosts are
+# aggregated into a JSON array in the same row, each host as an array of its
+# columns in Host field order.
+_GET_RACK = """
+    SELECT r.name, r.height, r.service_name, r.dc_name, r.room_name,
+        COALESCE(
+            json_agg(
+                json_build_array(
+                    h.name, h.height, h.ip, h.running, h.service_name,
+                    h.dc_name, h.room_name, h.rack_name, h.pos
+                )
+                ORDER BY h.pos
+            ) FILTER (WHERE h.name IS NOT NULL),
+            '[]'
+        ) AS hosts
+    FROM racks r
+    LEFT JOIN hosts h ON h.rack_name = r.name
+    WHERE r.name = $1
+    GROUP BY r.name
+"""
 
 class RackManager(BaseManager):
 
     # CREATE operations
+    @invalidates_cache
     def createRack(self, name: str, height: int, room_name: str) -> Rack:
         """
         Create a new rack in a room.
@@ -19,55 +66,84 @@ class RackManager(BaseManager):
         Returns:
             str: name of the newly created rack
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-
-                cursor.execute(
-                    "SELECT name, dc_name FROM rooms WHERE name = %s",
-                    (room_name,),
-                )
-                room_data = cursor.fetchone()
+        with self._session() as (conn, cursor):
+
+            # Insert the new rack, taking dc_name from its room in the same
+            # statement; no row is returned if the room does not exist
+            self.execute_cached(
+                cursor,
+                """
+                INSERT INTO racks (name, height, service_name, dc_name, room_name)
+                SELECT %s, %s, NULL, dc_name, name FROM rooms WHERE name = %s
+                RETURNING name, height, dc_name, room_name
+                """,
+                (name, height, room_name),
+            )
+            rack_data = cursor.fetchone()
+            if rack_data is None:
+                return None
+            conn.commit()
+
+            name, height, dc_name, room_name = rack_data
+            return Rack(
+                name=name,
+                height=height,
+                capacity=height,
+                n_hosts=0,
+                hosts=[],
+                service_name=None,  # A new rack is not assigned to any service
+                dc_name=dc_name,
+                room_name=room_name,
+            )
+
+    @invalidates_cache
+    def createRacks(self, racks: list[tuple[str, int, str]]) -> list[Rack]:
+        """
+        Create several racks with a single INSERT.
 
-                if room_data is None:
-                    return None
+        Args:
+            racks (list[tuple[str, int, str]]): (name, height, room_name) of each
+                rack to create
 
-                new_rack = Rack(
+        Returns:
+            list[Rack]: The created racks. Racks whose room does not exist are skipped.
+        """
+        if not racks:
+            return []
+
+        with self._session() as (conn, cursor):
+            rows = execute_values(
+                cursor,
+                """
+                INSERT INTO racks (name, height, service_name, dc_name, room_name)
+                SELECT v.name, v.height, NULL, rooms.dc_name, rooms.name
+                FROM (VALUES %s) AS v(name, height, room_name)
+                JOIN rooms ON rooms.name = v.room_name
+                RETURNING name, height, dc_name, room_name
+                """,
+                racks,
+                template="(%s, %s::int, %s)",
+                page_size=len(racks),
+                fetch=True,
+            )
+            conn.commit()
+
+            return [
+                Rack(
                     name=name,
                     height=height,
                     capacity=height,
                     n_hosts=0,
                     hosts=[],
-                    service_name=None,  # Service name is not provided in the current context
-                    dc_name=room_data["dc_name"],
-                    room_name=room_data["name"],
+                    service_name=None,
+                    dc_name=dc_name,
+                    room_name=room_name,
                 )
-
-                # Insert the new rack
-                cursor.execute(
-                    "INSERT INTO racks (name, height, service_name, dc_name, room_name) VALUES (%s, %s, %s, %s, %s)",
-                    (
-                        new_rack.name,
-                        new_rack.height,
-                        new_rack.service_name,
-                        new_rack.dc_name,
-                        new_rack.room_name,
-                    ),
-                )
-
-                conn.commit()
-                return new_rack
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+                for name, height, dc_name, room_name in rows
+            ]
 
     # READ operations
+    @cached_query
     def getRack(self, rack_name: str) -> Rack | None:
         """
         Get a rack by name.
@@ -78,66 +154,36 @@ class RackManager(BaseManager):
         Returns:
             Rack: Rack object if found, None otherwise
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT * FROM racks WHERE name = %s",
-                    (rack_name,),
-                )
-                result = cursor.fetchone()
-
-                if result is None:
-                    return None
-
-                # Get hosts for this rack
-                cursor.execute(
-                    "SELECT * FROM hosts WHERE rack_name = %s",
-                    (rack_name,),
-                )
-                hosts_data = cursor.fetchall()
-
-                hosts = [
-                    Host(
-                        name=host_data["name"],
-                        height=host_data["height"],
-                        ip=host_data["ip"],
-                        running=host_data["running"],
-                        service_name=host_data["service_name"],
-                        dc_name=host_data["dc_name"],
-                        room_name=host_data["room_name"],
-                        rack_name=host_data["rack_name"],
-                        pos=host_data["pos"],
-                    )
-                    for host_data in hosts_data
-                ]
-                # Calculate the number of hosts
-                n_hosts = len(hosts)
-                # Calculate the capacity
-                already_used = sum(host.height for host in hosts)
-                # Calculate the remaining capacity
-                capacity = result["height"] - already_used
-
-                # Create and return the Rack object
-                return Rack(
-                    name=result["name"],
-                    height=result["height"],
-                    capacity=capacity,
-                    n_hosts=len(hosts),
-                    hosts=hosts,
-                    service_name=result["service_name"],
-                    dc_name=result["dc_name"],
-                    room_name=result["room_name"],
-                )
-
-        except Exception as e:
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session(readonly=True) as (conn, cursor):
+            self.execute_prepared(cursor, "get_rack", _GET_RACK, (rack_name,))
+            result = cursor.fetchone()
+
+            if result is None:
+                return None
+            name, height, service_name, dc_name, room_name, hosts_data = result
+
+            hosts = [Host(*host_data) for host_data in hosts_data]
+            # Calculate the number of hosts
+            n_hosts = len(hosts)
+            # Calculate the capacity
+            already_used = sum(host.height for host in hosts)
+            # Calculate the remaining capacity
+            capacity = height - already_used
+
+            # Create and return the Rack object
+            return Rack(
+                name=name,
+                height=height,
+                capacity=capacity,
+                n_hosts=len(hosts),
+                hosts=hosts,
+                service_name=service_name,
+                dc_name=dc_name,
+                room_name=room_name,
+            )
 
     # UPDATE operations
+    @invalidates_cache
     def updateRack(
         self,
         rack_name: str,
@@ -157,65 +203,76 @@ class RackManager(BaseManager):
         Returns:
             bool: True if rack was successfully updated, False if not found
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # Build the update query based on provided parameters
-                update_params = []
-                query_parts = []
-
-                if name is not None:
-                    query_parts.append("name = %s")
-                    update_params.append(name)
-
-                if height is not None:
-                    query_parts.append("height = %s")
-                    update_params.append(height)
-
-                if room_name is not None:
-                    # TODO: implement logic of moving rack to a new room
-                    # check if new room exists
-                    cursor.execute(
-                        "SELECT name, dc_name FROM rooms WHERE name = %s", (room_name,)
-                    )
-                    new_room_data = cursor.fetchone()
-
-                    if new_room_data is None:
-                       return False
-
-                    new_dc_name = new_room_data["dc_name"]
-                    print(new_room_data)
-
-                    query_parts.append("room_name = %s")
-                    update_params.append(room_name)
-
-                    query_parts.append("dc_name = %s")
-                    update_params.append(new_dc_name)
-
-                if not query_parts:
-                    # Nothing to update
-                    return True
-
-                query = f"UPDATE racks SET {', '.join(query_parts)} WHERE name = %s"
-                update_params.append(rack_name)
-
-                cursor.execute(query, tuple(update_params))
-
-                conn.commit()
+        mask = (
+            (name is not None)
+            | (height is not None) << 1
+            | (room_name is not None) << 2
+        )
+        if not mask:
+            # Nothing to update
+            return True
+
+        with self._session() as (conn, cursor):
+            update_params = [v for v in (name, height) if v is not None]
+            update_params.append(rack_name)
+            if room_name is not None:
+                update_params.append(room_name)
+
+            # Each precomputed statement is prepared once it is used often
+            # enough, so every combination of fields is planned only once
+            self.execute_cached(
+                cursor, _UPDATE_RACK_QUERIES[mask], tuple(update_params)
+            )
+
+            conn.commit()
+
+            # Check if any rows were affected
+            return cursor.rowcount > 0
+
+    @invalidates_cache
+    def updateRacks(self, rows: list[dict]) -> int:
+        """
+        Update several racks in a single statement.
 
-                # Check if any rows were affected
-                return cursor.rowcount > 0
+        Args:
+            rows (list[dict]): One dict per rack with key "rack_name" (name of the
+                rack to update) and optional keys "name", "height" and "room_name"
+                holding the new values, as in updateRack
 
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        Returns:
+            int: Number of racks updated. Racks that do not exist or whose new
+                room does not exist are skipped.
+        """
+        if not rows:
+            return 0
+
+        with self._session() as (conn, cursor):
+            cursor.execute(
+                """
+                UPDATE racks
+                SET name = COALESCE(u.name, racks.name),
+                    height = COALESCE(u.height, racks.height),
+                    room_name = COALESCE(u.room_name, racks.room_name),
+                    dc_name = COALESCE(rooms.dc_name, racks.dc_name)
+                FROM unnest(%s::varchar[], %s::varchar[], %s::int[], %s::varchar[])
+                    AS u(rack_name, name, height, room_name)
+                LEFT JOIN rooms ON rooms.name = u.room_name
+                WHERE racks.name = u.rack_name
+                    AND (u.room_name IS NULL OR rooms.name IS NOT NULL)
+                """,
+                (
+                    [row["rack_name"] for row in rows],
+                    [row.get("name") for row in rows],
+                    [row.get("height") for row in rows],
+                    [row.get("room_name") for row in rows],
+                ),
+            )
+            conn.commit()
+
+            return cursor.rowcount
 
     # DELETE operations
+    @invalidates_cache
     def deleteRack(self, rack_name: str) -> bool:
         """
         Delete a rack from the database.
@@ -224,33 +281,41 @@ class RackManager(BaseManager):
             rack_name (str): Name of the rack to delete
 
         Returns:
-            bool: True if rack was successfully deleted, False if not found
+            bool: True if rack was successfully deleted, False if not found or
+                it still has hosts
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # First check if rack exists and get its room_id, datacenter_id, and service_id
-                cursor.execute(
-                    "SELECT name FROM racks WHERE name = %s",
-                    (rack_name,),
-                )
-                rack_info = cursor.fetchone()
+        return self.deleteRacks([rack_name]) > 0
 
-                if rack_info is None:
-                    return False
+    @invalidates_cache
+    def deleteRacks(self, rack_names: list[str]) -> int:
+        """
+        Delete several racks in a single statement.
+
+        Args:
+            rack_names (list[str]): Names of the racks to delete
+
+        Returns:
+            int: Number of racks deleted. Racks that still have hosts are skipped.
+        """
+        if not rack_names:
+            return 0
+
+        with self._session() as (conn, cursor):
+            self.execute_cached(
+                cursor,
+                """
+                DELETE FROM racks
+                WHERE name = ANY(%s)
+                    AND NOT EXISTS (
+                        SELECT 1 FROM hosts WHERE hosts.rack_name = racks.name
+                    )
+                """,
+                (list(rack_names),),
+            )
+            conn.commit()
 
-                # Delete the rack
-                cursor.execute("DELETE FROM racks WHERE name = %s", (rack_name,))
-                conn.commit()
+            return cursor.rowcount
 
-                # Check if any rows were affected
-                return cursor.rowcount > 0
 
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+# Shared instance used by the blueprints
+rack_manager = RackManager()
@@ -1,9 +1,58 @@
-from psycopg2.extras import RealDictCursor
 from utils.schema import Room, SimpleRack
 from DataBaseManage.connection import BaseManager
+from DataBaseManage.cache import cached_query, invalidates_cache
+
+# Statement of getRoom, prepared once per connection. Racks are aggregated
+# into a JSON array in the same row, each rack as an array of its columns in
+# SimpleRack field order. Host counts and used heights come from one grouped
+# scan of the room's hosts, the room's host count is the sum of its racks'.
+_GET_ROOM = """
+    SELECT ro.name, ro.height, ro.dc_name,
+        COALESCE(
+            json_agg(
+                json_build_array(
+                    r.name, r.height, r.height - COALESCE(h.used_height, 0),
+                    COALESCE(h.n_hosts, 0), r.service_name, r.room_name
+                )
+                ORDER BY r.name
+            ) FILTER (WHERE r.name IS NOT NULL),
+            '[]'
+        ) AS racks,
+        COALESCE(SUM(h.n_hosts), 0)::bigint AS n_hosts
+    FROM rooms ro
+    LEFT JOIN racks r ON r.room_name = ro.name
+    LEFT JOIN (
+        SELECT rack_name, COUNT(*) AS n_hosts, SUM(height) AS used_height
+        FROM hosts WHERE room_name = $1 GROUP BY rack_name
+    ) h ON h.rack_name = r.name
+    WHERE ro.name = $1
+    GROUP BY ro.name
+"""
+
+# SET clause of each optional updateRoom field, in bit order of the update mask
+_UPDATE_ROOM_FIELDS = ("height = %s", "name = %s", "dc_name = %s")
+_UPDATE_ROOM_DC_BIT = 1 << 2
+
+# Precomputed UPDATE statement for every combination of updated fields,
+# keyed by the bitmap built in updateRoom. A room is only moved to a new
+# datacenter if that datacenter exists.
+_UPDATE_ROOM_QUERIES = {
+    mask: "UPDATE rooms SET "
+    + ", ".join(
+        part for bit, part in enumerate(_UPDATE_ROOM_FIELDS) if mask >> bit & 1
+    )
+    + " WHERE name = %s"
+    + (
+        " AND EXISTS (SELECT 1 FROM datacenters WHERE name = %s)"
+        if mask & _UPDATE_ROOM_DC_BIT
+        else ""
+    )
+    for mask in range(1, 1 << len(_UPDATE_ROOM_FIELDS))
+}
 
 
 class RoomManager(BaseManager):
+    @invalidates_cache
     def createRoom(self, name: str, height: int, datacenter_name: str) -> Room:
         """
         Create a new room in a datacenter.
@@ -16,46 +65,35 @@ class RoomManager(BaseManager):
         Returns:
             Room: Room object if created successfully, None otherwise
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # Check if datacenter exists
-                cursor.execute(
-                    "SELECT name FROM datacenters WHERE name = %s",
-                    (datacenter_name,),
-                )
-                dc_data = cursor.fetchone()
-                if dc_data is None:
-                    return None
-
-                new_room = Room(
-                    name=name,
-                    height=height,
-                    n_racks=0,
-                    racks=[],
-                    n_hosts=0,
-                    dc_name=dc_data["name"],
-                )
-
-                # Insert the new room
-                cursor.execute(
-                    "INSERT INTO rooms (name, height, dc_name) VALUES (%s, %s, %s)",
-                    (new_room.name, new_room.height, new_room.dc_name),
-                )
-                conn.commit()
-
-                return new_room
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session() as (conn, cursor):
+            # Insert the new room, the datacenter existence check is folded
+            # into the INSERT so no row is returned if it does not exist
+            self.execute_cached(
+                cursor,
+                """
+                INSERT INTO rooms (name, height, dc_name)
+                SELECT %s, %s, name FROM datacenters WHERE name = %s
+                RETURNING name, height, dc_name
+                """,
+                (name, height, datacenter_name),
+            )
+            room_data = cursor.fetchone()
+            if room_data is None:
+                return None
+            conn.commit()
+
+            name, height, dc_name = room_data
+            return Room(
+                name=name,
+                height=height,
+                n_racks=0,
+                racks=[],
+                n_hosts=0,
+                dc_name=dc_name,
+            )
 
     # READ operations
+    @cached_query
     def getRoom(self, room_name: str) -> Room | None:
         """
         Get a room by name.
@@ -66,70 +104,28 @@ class RoomManager(BaseManager):
         Returns:
             Room: Room object if found, None otherwise
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT * FROM rooms WHERE name = %s",
-                    (room_name,),
-                )
-                room_data = cursor.fetchone()
-
-                if room_data is None:
-                    return None
-
-
-                # Get full rack information for this room
-                cursor.execute("SELECT * FROM racks WHERE room_name = %s", (room_name,))
-                racks_data = cursor.fetchall()
-
-                # calculate the count of hosts and capacity of racks
-                racks = []
-                for rack_data in racks_data:
-                    # Get hosts for this rack
-                    cursor.execute(
-                        "SELECT * FROM hosts WHERE rack_name = %s",
-                        (rack_data["name"],),
-                    )
-                    hosts_data = cursor.fetchall()
-                    # Calculate the number of hosts in this rack
-                    n_hosts = len(hosts_data)
-                    already_used_capacity = sum(host["height"] for host in hosts_data)
-                    capacity = rack_data["height"] - already_used_capacity
-                    racks.append(
-                        SimpleRack(
-                            name=rack_data["name"],
-                            height=rack_data["height"],
-                            capacity=capacity,
-                            n_hosts=n_hosts,
-                            service_name=rack_data["service_name"],
-                            room_name=room_data["name"],
-                        )
-                    )
-                # Calculate the number of hosts in the room
-                cursor.execute(
-                    "SELECT COUNT(*) FROM hosts WHERE room_name = %s", (room_name,)
-                )
-                result = cursor.fetchone()
-                n_hosts = result["count"] if result else 0
-                # Create and return the Room object
-                return Room(
-                    name=room_data["name"],
-                    height=room_data["height"],
-                    n_racks=len(racks),
-                    racks=racks,
-                    n_hosts=n_hosts,
-                    dc_name=room_data["dc_name"],
-                )
-
-        except Exception as e:
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session(readonly=True) as (conn, cursor):
+            # Get the room together with its racks and host count in one row
+            self.execute_prepared(cursor, "get_room", _GET_ROOM, (room_name,))
+            room_data = cursor.fetchone()
+
+            if room_data is None:
+                return None
+            name, height, dc_name, racks_data, n_hosts = room_data
+
+            racks = [SimpleRack(*rack_data) for rack_data in racks_data]
+            # Create and return the Room object
+            return Room(
+                name=name,
+                height=height,
+                n_racks=len(racks),
+                racks=racks,
+                n_hosts=n_hosts,
+                dc_name=dc_name,
+            )
 
     # UPDATE operations
+    @invalidates_cache
     def updateRoom(
         self,
         old_name: str,
@@ -149,58 +145,33 @@ class RoomManager(BaseManager):
         Returns:
             bool: True if room was successfully updated, False if not found
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # First check if room exists
-                cursor.execute("SELECT name FROM rooms WHERE name = %s", (old_name,))
-                if cursor.fetchone() is None:
-                    return False
-
-                # Build the update query based on provided parameters
-                update_params = []
-                query_parts = []
-
-                if height is not None:
-                    query_parts.append("height = %s")
-                    update_params.append(height)
-
-                if new_name is not None:
-                    query_parts.append("name = %s")
-                    update_params.append(new_name)
-                if dc_name is not None:
-                    # Check if new datacenter exists
-                    cursor.execute(
-                        "SELECT name FROM datacenters WHERE name = %s", (dc_name,)
-                    )
-                    if cursor.fetchone() is None:
-                        return False
-                    query_parts.append("dc_name = %s")
-                    update_params.append(dc_name)
-
-                if not query_parts:
-                    # Nothing to update
-                    return True
-
-                query = f"UPDATE rooms SET {', '.join(query_parts)} WHERE name = %s"
-                update_params.append(old_name)
-                # Execute the update query
-                cursor.execute(query, tuple(update_params))
-                conn.commit()
-
-                # Check if any rows were affected
-                return cursor.rowcount > 0
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session() as (conn, cursor):
+            mask = (
+                (height is not None)
+                | (new_name is not None) << 1
+                | (dc_name is not None) << 2
+            )
+            if not mask:
+                # Nothing to update, only report whether the room exists
+                self.execute_cached(
+                    cursor, "SELECT 1 FROM rooms WHERE name = %s", (old_name,)
+                )
+                return cursor.fetchone() is not None
+
+            update_params = [v for v in (height, new_name, dc_name) if v is not None]
+            update_params.append(old_name)
+            if dc_name is not None:
+                update_params.append(dc_name)
+            self.execute_cached(
+                cursor, _UPDATE_ROOM_QUERIES[mask], tuple(update_params)
+            )
+            conn.commit()
+
+            # No affected rows means the room or the new datacenter does not exist
+            return cursor.rowcount > 0
 
     # DELETE operations
+    @invalidates_cache
     def deleteRoom(self, room_name: str) -> bool:
         """
         Delete a room from the database.
@@ -209,32 +180,25 @@ class RoomManager(BaseManager):
             room_name (str): name of the room to delete
 
         Returns:
-            bool: True if room was successfully deleted, False if not found
+            bool: True if room was successfully deleted, False if not found or
+                it still has racks
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # First check if room exists and get its datacenter_id
-                cursor.execute(
-                    "SELECT dc_name FROM rooms WHERE name = %s", (room_name,)
-                )
-                room_data = cursor.fetchone()
-
-                if room_data is None:
-                    return False
-
-                # Delete the room
-                cursor.execute("DELETE FROM rooms WHERE name = %s", (room_name,))
-                conn.commit()
-
-                # Check if any rows were affected
-                return cursor.rowcount > 0
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session() as (conn, cursor):
+            # Delete the room, the check for racks left in it is folded into
+            # the DELETE so no row is affected if there are any
+            self.execute_cached(
+                cursor,
+                """
+                DELETE FROM rooms WHERE name = %s
+                AND NOT EXISTS (SELECT 1 FROM racks WHERE room_name = %s)
+                """,
+                (room_name, room_name),
+            )
+            conn.commit()
+
+            # Check if any rows were affected
+            return cursor.rowcount > 0
+
+
+# Shared instance used by the blueprints
+room_manager = RoomManager()
@@ -1,33 +1,152 @@
 from utils.schema import Service, SimpleRack, SimpleService, Host
 from DataBaseManage.connection import BaseManager
-import psycopg2
-import psycopg2.extras
-import ipaddress
+from DataBaseManage.cache import cached_query, invalidates_cache
+from collections import defaultdict
+from psycopg2.errors import InvalidTextRepresentation
+
+# Statement of getService, prepared once per connection. Subnets, IPs and
+# racks are aggregated into JSON arrays in the same row. Each rack carries its
+# hosts, each host as an array of its columns in Host field order.
+_GET_SERVICE = """
+    SELECT s.name, s.username,
+        COALESCE(
+            (SELECT json_agg(subnet ORDER BY subnet) FROM subnets
+             WHERE service_name = s.name),
+            '[]'
+        ) AS subnets,
+        COALESCE(
+            (SELECT json_agg(ip ORDER BY ip) FROM IPs
+             WHERE service_name = s.name),
+            '[]'
+        ) AS total_ips,
+        COALESCE(
+            (SELECT json_agg(ip ORDER BY ip) FROM IPs
+             WHERE service_name = s.name AND assigned = FALSE),
+            '[]'
+        ) AS available_ips,
+        COALESCE(
+            (SELECT json_agg(
+                json_build_object(
+                    'name', r.name,
+                    'height', r.height,
+                    'dc_name', r.dc_name,
+                    'room_name', r.room_name,
+                    'hosts', COALESCE(
+                        (SELECT json_agg(
+                            json_build_array(
+                                h.name, h.height, h.ip, h.running, h.service_name,
+                                h.dc_name, h.room_name, h.rack_name, h.pos
+                            )
+                            ORDER BY h.pos
+                        ) FROM hosts h WHERE h.rack_name = r.name),
+                        '[]'
+                    )
+                )
+                ORDER BY r.dc_name, r.name
+            ) FROM racks r WHERE r.service_name = s.name),
+            '[]'
+        ) AS racks
+    FROM services s
+    WHERE s.name = $1
+"""
+
 
 class ServiceManager(BaseManager):
     """Class for managing service operations"""
-    def subnet_to_iplist(self, subnet: str) -> list[str]:
+    @staticmethod
+    def _insert_subnet_ips(cursor, service_name: str, subnet: str) -> list[str]:
         """
-        Convert a subnet to a list of IP addresses.
+        Insert the unassigned IPs of a service subnet in a single statement.
+
+        The host addresses are generated by the server with subnet_hosts(),
+        so neither the statement nor its parameters grow with the subnet.
 
         Args:
-            subnet (str): Subnet in CIDR notation
-                e.g. 168.0.0/24
+            cursor: Cursor of a pooled connection
+            service_name (str): Name of the service owning the IPs
+            subnet (str): Subnet in CIDR notation, already stored in subnets
 
         Returns:
-            list[str]: List of IP addresses in the subnet
+            list[str]: The inserted IP addresses
+        """
+        cursor.execute(
+            """
+            INSERT INTO IPs (ip, service_name, assigned)
+            SELECT subnet_hosts(%s::cidr), %s, FALSE
+            RETURNING host(ip)
+            """,
+            (subnet, service_name),
+        )
+        return [ip for (ip,) in cursor.fetchall()]
+
+    @staticmethod
+    def _allocate_racks(
+        cursor, service_name: str, n_allocated_racks: dict[str, int]
+    ) -> list[tuple[str, int, bool, list]]:
         """
-        try:
-            # Create an IP network object
-            network = ipaddress.ip_network(subnet, strict=False)
-            # Generate a list of all IP addresses in the subnet
-            ip_list = [str(ip) for ip in network.hosts()]
-            return ip_list
-        except ValueError as e:
-            raise Exception(f"Invalid subnet: {e}")
-        except Exception as e:
-            raise Exception(f"Error generating IP list: {e}")
+        Assign free racks of several datacenters to a service in one statement.
 
+        For every requested datacenter, up to the requested number of racks not
+        assigned to any service are assigned to the service. Racks locked by a
+        concurrent allocation are skipped and a rack is never taken from
+        another service, so a lost race shows up as a shortage. The caller checks
+        the result and raises if a datacenter is missing or short of racks,
+        which rolls the assignment back.
+
+        Args:
+            cursor: Cursor of a pooled connection
+            service_name (str): Name of the service the racks are assigned to
+            n_allocated_racks (dict[str, int]): Number of racks to assign in
+                each datacenter
+
+        Returns:
+            list[tuple]: (dc_name, n_racks, dc_exists, racks) per requested
+                datacenter in request order, racks being [name, height,
+                room_name] of each assigned rack
+        """
+        if not n_allocated_racks:
+            return []
+        cursor.execute(
+            """
+            WITH req AS (
+                SELECT * FROM unnest(%s::text[], %s::int[])
+                    WITH ORDINALITY AS r(dc_name, n_racks, ord)
+            ), picked AS MATERIALIZED (
+                -- Evaluated once, so the rows this statement updates are not
+                -- skipped and replaced by other free racks on a rescan
+                SELECT free.name FROM req
+                CROSS JOIN LATERAL (
+                    SELECT name FROM racks
+                    WHERE service_name IS NULL AND dc_name = req.dc_name
+                    LIMIT req.n_racks
+                    FOR UPDATE SKIP LOCKED
+                ) free
+            ), assigned AS (
+                UPDATE racks SET service_name = %s
+                FROM picked
+                WHERE racks.name = picked.name AND racks.service_name IS NULL
+                RETURNING racks.dc_name, racks.name, racks.height, racks.room_name
+            )
+            SELECT req.dc_name, req.n_racks,
+                EXISTS (SELECT 1 FROM datacenters WHERE name = req.dc_name),
+                COALESCE(
+                    json_agg(json_build_array(a.name, a.height, a.room_name))
+                        FILTER (WHERE a.name IS NOT NULL),
+                    '[]'
+                )
+            FROM req LEFT JOIN assigned a ON a.dc_name = req.dc_name
+            GROUP BY req.dc_name, req.n_racks, req.ord
+            ORDER BY req.ord
+            """,
+            (
+                list(n_allocated_racks),
+                list(n_allocated_racks.values()),
+                service_name,
+            ),
+        )
+        return cursor.fetchall()
+
+    @invalidates_cache
     def createService(
         self, name: str, n_allocated_racks: dict[str, int], allocated_subnets: list[str], username: str
     ) -> Service | None:
@@ -44,192 +163,121 @@ class ServiceManager(BaseManager):
             Service: A Service object representing the newly created service.
             None: If creation fails
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                # Check if username exists
-                cursor.execute(
-                    "SELECT username FROM users WHERE username = %s", (username,)
-                )
-                user_data = cursor.fetchone()
-                if user_data is None:
-                    raise Exception(f"User {username} does not exist")
-
-                # Insert the new service
-                cursor.execute(
-                    "INSERT INTO services (name, username) VALUES (%s, %s)RETURNING name, username",
-                    (name, username),
-                )
-                # Get the newly created service data
-                new_service = cursor.fetchone()
-
-                if not new_service:
-                    conn.rollback()
-                    return None
-
-                # Generate IP list from subnet
-                total_ips_list = []
-                available_ips_list = []
-                for allocated_subnet in allocated_subnets:
-                    # Check if subnet is valid
-                    try:
-                        ipaddress.ip_network(allocated_subnet, strict=True)
-                    except ValueError:
-                        raise Exception(f"Invalid subnet: {allocated_subnet}")
-                    # Check if subnet already exists in the database
-                    cursor.execute(
-                        "SELECT * FROM subnets WHERE subnet = %s", (allocated_subnet,)
-                    )
-                    existing_subnet = cursor.fetchone()
-                    if existing_subnet:
-                        raise Exception(f"Subnet {allocated_subnet} already exists in the database")
-                    ip_list = self.subnet_to_iplist(allocated_subnet)
-
-                    # Find existing IPs in the database
-                    # cursor.execute(
-                    #     "SELECT * FROM IPs WHERE ip::text IN %s", (tuple(ip_list),)
-                    # )
-                    # existing_ips = cursor.fetchall()
-                    # if existing_ips:
-                    #     raise Exception(
-                    #         f"IP addresses {', '.join(ip['ip'] for ip in existing_ips)} already exist in the database"
-                    #     )
-
-                    # Insert the new subnet into the subnets table
+        with self._session() as (conn, cursor):
+            # Insert the new service, the user existence check is folded
+            # into the INSERT so no row is returned if the user does not exist
+            cursor.execute(
+                """
+                INSERT INTO services (name, username)
+                SELECT %s, username FROM users WHERE username = %s
+                RETURNING name, username
+                """,
+                (name, username),
+            )
+            # Get the newly created service data
+            new_service = cursor.fetchone()
+            if new_service is None:
+                raise Exception(f"User {username} does not exist")
+
+            # Store each subnet and generate its IPs
+            total_ips_list = []
+            available_ips_list = []
+            for allocated_subnet in allocated_subnets:
+                # Insert the new subnet into the subnets table, no row is
+                # returned if the subnet already exists. The CIDR cast rejects
+                # malformed subnets and subnets with host bits set.
+                try:
                     cursor.execute(
                         """
                         INSERT INTO subnets (subnet, service_name)
-                        VALUES (%s, %s)
+                        VALUES (%s::cidr, %s)
                         ON CONFLICT (subnet) DO NOTHING
                         RETURNING subnet
                         """,
                         (allocated_subnet, name),
                     )
-                    for ip in ip_list:
-                        cursor.execute(
-                            """
-                            INSERT INTO IPs (ip, service_name, assigned)
-                            VALUES (%s, %s, FALSE)
-                            """,
-                            (ip, name)
-                        )
-
-                    total_ips_list += ip_list
-                    available_ips_list += ip_list
+                except InvalidTextRepresentation:
+                    raise Exception(f"Invalid subnet: {allocated_subnet}")
+                if cursor.fetchone() is None:
+                    raise Exception(f"Subnet {allocated_subnet} already exists in the database")
+                ip_list = self._insert_subnet_ips(cursor, name, allocated_subnet)
 
+                total_ips_list += ip_list
+                available_ips_list += ip_list
 
-                # Process allocated racks for each datacenter
-                all_assigned_racks = {}
-                all_hosts = []
 
-                for dc_name, n_racks in n_allocated_racks.items():
-                    # Check if datacenter exists
-                    cursor.execute(
-                        "SELECT name FROM datacenters WHERE name = %s", (dc_name,)
-                    )
-                    dc_data = cursor.fetchone()
-                    if dc_data is None:
-                        raise Exception(f"Datacenter named {dc_name} does not exist")
+            # Process allocated racks for each datacenter
+            all_assigned_racks = {}
+            all_hosts = []
 
-                    # Find {n_racks} racks that are not assigned to any service in this DC
-                    cursor.execute(
-                        """
-                        SELECT name FROM racks
-                        WHERE service_name IS NULL AND dc_name = %s
-                        LIMIT %s
-                        """,
-                        (dc_name, n_racks),
+            # Assign the racks of every datacenter in one statement
+            for dc_name, n_racks, dc_exists, racks in self._allocate_racks(
+                cursor, name, n_allocated_racks
+            ):
+                if not dc_exists:
+                    raise Exception(f"Datacenter named {dc_name} does not exist")
+                if len(racks) < n_racks:
+                    raise Exception(
+                        f"Not enough available racks in datacenter {dc_name} to assign to service {name}"
                     )
-                    racks_data = cursor.fetchall()
-
-                    if len(racks_data) < n_racks:
-                        raise Exception(
-                            f"Not enough available racks in datacenter {dc_name} to assign to service {name}"
-                        )
-
-                    # Assign racks to the service
-                    assigned_racks = []
-                    for rack_data in racks_data:
-                        rack_name = rack_data["name"]
-
-                        cursor.execute(
-                            """
-                            UPDATE racks
-                            SET service_name = %s
-                            WHERE name = %s
-                            RETURNING *
-                            """,
-                            (name, rack_name),
-                        )
-                        updated_rack = cursor.fetchone()
-
-                        # Get hosts for this rack
-                        cursor.execute(
-                            "SELECT * FROM hosts WHERE rack_name = %s",
-                            (rack_name,),
-                        )
-                        hosts_data = cursor.fetchall()
-                        rack_hosts = [
-                            Host(
-                                name=host_data["name"],
-                                height=host_data["height"],
-                                ip=host_data["ip"],
-                                running=host_data["running"],
-                                service_name=host_data["service_name"],
-                                dc_name=host_data["dc_name"],
-                                room_name=host_data["room_name"],
-                                rack_name=host_data["rack_name"],
-                                pos=host_data["pos"],
-                            )
-                            for host_data in hosts_data
-                        ]
-                        all_hosts.extend(rack_hosts)
-
-                        # Calculate the number of hosts
-                        n_hosts = len(rack_hosts)
-                        # Calculate the capacity
-                        already_used = sum(host.height for host in rack_hosts)
-                        # Calculate the remaining capacity
-                        capacity = updated_rack["height"] - already_used
-
-                        if updated_rack:
-                            assigned_racks.append(
-                                SimpleRack(
-                                    name=updated_rack["name"],
-                                    height=updated_rack["height"],
-                                    capacity=capacity,
-                                    n_hosts=n_hosts,
-                                    service_name=name,
-                                    room_name=updated_rack["room_name"],
-                                )
-                            )
-
-                    # Store the racks for this datacenter
-                    all_assigned_racks[dc_name] = assigned_racks
-
-                # Commit all changes
-                conn.commit()
-
-                # Create and return a Service object
-                return Service(
-                    name=name,
-                    allocated_racks=all_assigned_racks,
-                    hosts=all_hosts,
-                    username=username,
-                    allocated_subnets=allocated_subnets,
-                    total_ip_list=total_ips_list,
-                    available_ip_list=available_ips_list,
+                all_assigned_racks[dc_name] = racks
+
+            # Get hosts of every assigned rack in one query
+            hosts_by_rack = defaultdict(list)
+            assigned_rack_names = [
+                rack_name
+                for racks in all_assigned_racks.values()
+                for rack_name, _, _ in racks
+            ]
+            if assigned_rack_names:
+                cursor.execute(
+                    """
+                    SELECT name, height, ip, running, service_name,
+                        dc_name, room_name, rack_name, pos
+                    FROM hosts WHERE rack_name = ANY(%s)
+                    """,
+                    (assigned_rack_names,),
                 )
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
-
+                for host_data in cursor.fetchall():
+                    # Columns are selected in Host field order
+                    host = Host(*host_data)
+                    hosts_by_rack[host.rack_name].append(host)
+                    all_hosts.append(host)
+
+            for dc_name, racks in all_assigned_racks.items():
+                assigned_racks = []
+                for rack_name, rack_height, room_name in racks:
+                    rack_hosts = hosts_by_rack[rack_name]
+                    # Calculate the remaining capacity
+                    capacity = rack_height - sum(host.height for host in rack_hosts)
+                    assigned_racks.append(
+                        SimpleRack(
+                            name=rack_name,
+                            height=rack_height,
+                            capacity=capacity,
+                            n_hosts=len(rack_hosts),
+                            service_name=name,
+                            room_name=room_name,
+                        )
+                    )
+                # Store the racks for this datacenter
+                all_assigned_racks[dc_name] = assigned_racks
+
+            # Commit all changes
+            conn.commit()
+
+            # Create and return a Service object
+            return Service(
+                name=name,
+                allocated_racks=all_assigned_racks,
+                hosts=all_hosts,
+                username=username,
+                allocated_subnets=allocated_subnets,
+                total_ip_list=total_ips_list,
+                available_ip_list=available_ips_list,
+            )
+
+    @cached_query
     def getService(self, service_name: str) -> Service | None:
         """
         Get a service from the database.
@@ -241,129 +289,52 @@ class ServiceManager(BaseManager):
             Service: Service object if found
             None: If service not found
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                # Get the specific service
-                cursor.execute(
-                    "SELECT * FROM services WHERE name = %s", (service_name,)
-                )
-                data = cursor.fetchone()
-                if not data:
-                    return None
-
-                # Get all datacenters that have racks for this service
-                cursor.execute(
-                    """
-                    SELECT DISTINCT dc_name
-                    FROM racks
-                    WHERE service_name = %s
-                    """,
-                    (service_name,)
-                )
-                dc_data = cursor.fetchall()
-                dc_names = [dc["dc_name"] for dc in dc_data]
-
-                # Initialize allocated_racks dictionary
-                allocated_racks = {dc_name: [] for dc_name in dc_names}
-                all_hosts = []
-
-                # For each datacenter, get the racks
-                for dc_name in dc_names:
-                    cursor.execute(
-                        """
-                        SELECT * FROM racks
-                        WHERE service_name = %s AND dc_name = %s
-                        """,
-                        (service_name, dc_name)
+        with self._session() as (conn, cursor):
+            # Get the service together with its subnets, IPs, racks and the
+            # hosts of every rack in one row
+            self.execute_prepared(
+                cursor, "get_service", _GET_SERVICE, (service_name,)
+            )
+            data = cursor.fetchone()
+            if not data:
+                return None
+            name, username, subnets, total_ips, available_ips, racks = data
+
+            allocated_racks = {}
+            all_hosts = []
+            for rack_data in racks:
+                # Hosts are arrays of their columns in Host field order
+                rack_hosts = [Host(*host_data) for host_data in rack_data["hosts"]]
+                all_hosts.extend(rack_hosts)
+
+                # Calculate the capacity
+                already_used = sum(host.height for host in rack_hosts)
+                capacity = rack_data["height"] - already_used
+
+                # Create a SimpleRack object
+                allocated_racks.setdefault(rack_data["dc_name"], []).append(
+                    SimpleRack(
+                        name=rack_data["name"],
+                        height=rack_data["height"],
+                        capacity=capacity,
+                        n_hosts=len(rack_hosts),
+                        service_name=service_name,
+                        room_name=rack_data["room_name"],
                     )
-                    racks_data = cursor.fetchall()
-
-                    # Process each rack in this datacenter
-                    for rack_data in racks_data:
-                        # Get hosts for this rack
-                        cursor.execute(
-                            "SELECT * FROM hosts WHERE rack_name = %s",
-                            (rack_data["name"],),
-                        )
-                        hosts_data = cursor.fetchall()
-                        rack_hosts = [
-                            Host(
-                                name=host_data["name"],
-                                height=host_data["height"],
-                                ip=host_data["ip"],
-                                running=host_data["running"],
-                                service_name=host_data["service_name"],
-                                dc_name=host_data["dc_name"],
-                                room_name=host_data["room_name"],
-                                rack_name=host_data["rack_name"],
-                                pos=host_data["pos"],
-                            )
-                            for host_data in hosts_data
-                        ]
-                        all_hosts.extend(rack_hosts)
-
-                        # Calculate the capacity
-                        already_used = sum(host.height for host in rack_hosts)
-                        capacity = rack_data["height"] - already_used
-
-                        # Create a SimpleRack object
-                        allocated_racks[dc_name].append(
-                            SimpleRack(
-                                name=rack_data["name"],
-                                height=rack_data["height"],
-                                capacity=capacity,
-                                n_hosts=len(rack_hosts),
-                                service_name=service_name,
-                                room_name=rack_data["room_name"],
-                            )
-                        )
-
-                # Get all IP addresses for this service
-                cursor.execute(
-                    "SELECT ip FROM IPs WHERE service_name = %s",
-                    (service_name,)
-                )
-                ip_data = cursor.fetchall()
-                total_ip_list = [ip["ip"] for ip in ip_data]
-
-                # Get available (not assigned) IP addresses for this service
-                cursor.execute(
-                    """
-                    SELECT ip FROM IPs
-                    WHERE service_name = %s AND assigned = FALSE
-                    """,
-                    (service_name,),
-                )
-                available_ip_data = cursor.fetchall()
-                available_ip_list = [ip["ip"] for ip in available_ip_data]
-                # get the subnet of this service
-                cursor.execute(
-                    "SELECT subnet FROM subnets WHERE service_name = %s",
-                    (service_name,)
-                )
-                subnets = cursor.fetchall()
-                subnets = [subnet["subnet"] for subnet in subnets]
-                # Create and return a Service object
-                return Service(
-                    name=data["name"],
-                    allocated_racks=allocated_racks,
-                    hosts=all_hosts,
-                    username=data["username"],
-                    allocated_subnets=subnets,
-                    total_ip_list=total_ip_list,
-                    available_ip_list=available_ip_list,
                 )
 
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
-
+            # Create and return a Service object
+            return Service(
+                name=name,
+                allocated_racks=allocated_racks,
+                hosts=all_hosts,
+                username=username,
+                allocated_subnets=subnets,
+                total_ip_list=total_ips,
+                available_ip_list=available_ips,
+            )
+
+    @cached_query
     def getAllServices(self) -> list[SimpleService]:
         """
         Get all services from the database.
@@ -371,86 +342,49 @@ class ServiceManager(BaseManager):
         Returns:
             list[SimpleService]: List of all SimpleService objects
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                cursor.execute("""
-                    SELECT s.name, s.username, COUNT(DISTINCT r.name) AS rack_count,
-                        COUNT(DISTINCT h.name) AS host_count,
-                        COUNT(DISTINCT i.ip) AS ip_count
-                    FROM services s
-                    LEFT JOIN racks r ON s.name = r.service_name
-                    LEFT JOIN hosts h ON r.name = h.rack_name
-                    LEFT JOIN IPs i ON s.name = i.service_name
-                    WHERE s.name IS NOT NULL
-                    GROUP BY s.name, s.username
-                    ORDER BY s.name
-                """)
-                # Fetch all services with their counts
-                services_data = cursor.fetchall()
-                service_list = []
-                for data in services_data:
-                    service_name = data["name"]
-
-                    # get all the subnets of this service
-                    cursor.execute(
-                        "SELECT subnet FROM subnets WHERE service_name = %s",
-                        (service_name,)
-                    )
-                    subnets = cursor.fetchall()
-                    subnets = [subnet["subnet"] for subnet in subnets]
-                    # get total IP addresses of this service
-                    cursor.execute(
-                        "SELECT ip FROM IPs WHERE service_name = %s",
-                        (service_name,)
-                    )
-                    ip_data = cursor.fetchall()
-                    total_ip_list = [ip["ip"] for ip in ip_data]
-                    # get available IP addresses of this service
-                    cursor.execute(
-                        """
-                        SELECT ip FROM IPs
-                        WHERE service_name = %s AND assigned = FALSE
-                        """,
-                        (service_name,)
-                    )
-                    available_ip_data = cursor.fetchall()
-                    available_ip_list = [ip["ip"] for ip in available_ip_data]
-
-                    # get {dc_name: n_rack} dict
-                    cursor.execute("""
-                        SELECT dc_name, COUNT(DISTINCT name) AS rack_count
-                        FROM racks
-                        WHERE service_name = %s
-                        GROUP BY dc_name
-                    """, (service_name,))
-                    dc_rack_rows = cursor.fetchall()
-                    dc_rack_dict = {row["dc_name"]: row["rack_count"] for row in dc_rack_rows}
-
-                    # Create a SimpleService object with summary information
-                    service_list.append(
-                        SimpleService(
-                            name=service_name,
-                            username=data["username"],
-                            allocated_subnets=subnets,
-                            n_allocated_racks=dc_rack_dict,
-                            n_hosts=data["host_count"],
-                            total_ip_list= total_ip_list,
-                            available_ip_list= available_ip_list,
-                        )
-                    )
-
-                return service_list
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
-
+        # Rows are returned as SimpleService objects, columns are selected in
+        # SimpleService field order
+        with self._session(readonly=True, row_class=SimpleService) as (conn, cursor):
+            # Fetch every service with its subnets, IPs, rack count per
+            # datacenter and host count aggregated by the database in a
+            # single query
+            cursor.execute("""
+                SELECT s.name,
+                    COALESCE(
+                        (SELECT json_object_agg(dc_name, n_racks)
+                         FROM (
+                            SELECT dc_name, COUNT(*) AS n_racks FROM racks
+                            WHERE service_name = s.name AND dc_name IS NOT NULL
+                            GROUP BY dc_name
+                         ) AS dc_racks),
+                        '{}'
+                    ) AS n_allocated_racks,
+                    (SELECT COUNT(*) FROM hosts h
+                     JOIN racks r ON r.name = h.rack_name
+                     WHERE r.service_name = s.name) AS n_hosts,
+                    s.username,
+                    COALESCE(
+                        (SELECT json_agg(subnet ORDER BY subnet) FROM subnets
+                         WHERE service_name = s.name),
+                        '[]'
+                    ) AS subnets,
+                    COALESCE(
+                        (SELECT json_agg(ip ORDER BY ip) FROM IPs
+                         WHERE service_name = s.name),
+                        '[]'
+                    ) AS total_ips,
+                    COALESCE(
+                        (SELECT json_agg(ip ORDER BY ip) FROM IPs
+                         WHERE service_name = s.name AND assigned = FALSE),
+                        '[]'
+                    ) AS available_ips
+                FROM services s
+                ORDER BY s.name
+            """)
+
+            return cursor.fetchall()
+
+    @invalidates_cache
     def updateService(
         self,
         service_name: str,
@@ -470,106 +404,62 @@ class ServiceManager(BaseManager):
             Service: Updated Service object
             None: If service not found or update fails
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                # First check if service exists
-                cursor.execute("SELECT * FROM services WHERE name = %s", (service_name,))
-                service = cursor.fetchone()
-                if not service:
+        if new_name is None and new_n_allocated_racks is None:
+            # Nothing to update, return the service as is without borrowing
+            # a connection for the update
+            return self.getService(service_name)
+
+        with self._session() as (conn, cursor):
+            update_name = new_name if new_name else service_name
+
+            if new_name is not None:
+                # Rename the service, no returned row means it does not
+                # exist. Racks, subnets and IPs follow through ON UPDATE
+                # CASCADE, hosts have no foreign key on the service.
+                cursor.execute(
+                    """
+                    UPDATE services
+                    SET name = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE name = %s
+                    RETURNING name
+                    """,
+                    (new_name, service_name),
+                )
+                if cursor.fetchone() is None:
                     return None
 
-                update_name = new_name if new_name else service_name
-
-                # Prepare update query parts for service table
-                update_parts = []
-                params = []
-
-                if new_name is not None:
-                    update_parts.append("name = %s")
-                    params.append(new_name)
-
-                # Update the service record if there are changes
-                if update_parts:
-                    # Add updated_at to be updated
-                    update_parts.append("updated_at = CURRENT_TIMESTAMP")
-
-                    # Build and execute update query
-                    query = f"UPDATE services SET {', '.join(update_parts)} WHERE name = %s RETURNING *"
-                    params.append(service_name)
-
-                    cursor.execute(query, params)
-                    updated_service = cursor.fetchone()
-
-                    # If name was updated, update all references
-                    if new_name is not None:
-                        # Update service_name in racks table
-                        cursor.execute(
-                            "UPDATE racks SET service_name = %s WHERE service_name = %s",
-                            (new_name, service_name)
-                        )
-
-                        # Update service_name in hosts table
-                        cursor.execute(
-                            "UPDATE hosts SET service_name = %s WHERE service_name = %s",
-                            (new_name, service_name)
-                        )
-
-                        # Update service_name in IPs table
-                        cursor.execute(
-                            "UPDATE IPs SET service_name = %s WHERE service_name = %s",
-                            (new_name, service_name)
-                        )
-                else:
-                    updated_service = service
-
-                # Handle new rack allocations if provided
-                if new_n_allocated_racks is not None:
-                    for dc_name, n_racks in new_n_allocated_racks.items():
-                        # Verify datacenter exists
-                        cursor.execute(
-                            "SELECT name FROM datacenters WHERE name = %s",
-                            (dc_name,)
-                        )
-                        if cursor.fetchone() is None:
-                            raise Exception(f"Datacenter {dc_name} does not exist")
-
-                        # Find available racks in this datacenter
-                        cursor.execute(
-                            """
-                            SELECT name FROM racks
-                            WHERE service_name IS NULL AND dc_name = %s
-                            LIMIT %s
-                            """,
-                            (dc_name, n_racks)
-                        )
-                        available_racks = cursor.fetchall()
-
-                        if len(available_racks) < n_racks:
-                            raise Exception(f"Not enough available racks in datacenter {dc_name}")
-
-                        # Assign new racks to this service
-                        for rack in available_racks:
-                            cursor.execute(
-                                "UPDATE racks SET service_name = %s WHERE name = %s",
-                                (update_name, rack["name"])
-                            )
-
-                # Commit all changes
-                conn.commit()
-
-                # Return the updated service
-                return self.getService(update_name)
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+                # Update service_name in hosts table
+                cursor.execute(
+                    "UPDATE hosts SET service_name = %s WHERE service_name = %s",
+                    (new_name, service_name)
+                )
+            else:
+                # Only racks are allocated, check that the service exists
+                cursor.execute(
+                    "SELECT 1 FROM services WHERE name = %s", (service_name,)
+                )
+                if cursor.fetchone() is None:
+                    return None
 
+            # Handle new rack allocations if provided
+            if new_n_allocated_racks is not None:
+                # Assign the racks of every datacenter in one statement
+                for dc_name, n_racks, dc_exists, racks in self._allocate_racks(
+                    cursor, update_name, new_n_allocated_racks
+                ):
+                    if not dc_exists:
+                        raise Exception(f"Datacenter {dc_name} does not exist")
+                    if len(racks) < n_racks:
+                        raise Exception(f"Not enough available racks in datacenter {dc_name}")
+
+            # Commit all changes
+            conn.commit()
+
+        # Return the updated service, read after the connection is released
+        # so the read does not hold a second pooled connection
+        return self.getService(update_name)
+
+    @invalidates_cache
     def deleteService(self, service_name: str) -> bool:
         """
         Delete a service from the database.
@@ -580,63 +470,42 @@ class ServiceManager(BaseManager):
         Returns:
             bool: True if service was successfully deleted, False if not found
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor() as cursor:
-                # First check if service exists
-                cursor.execute(
-                    "SELECT name FROM services WHERE name = %s", (service_name,)
-                )
-                if cursor.fetchone() is None:
-                    return False
-
-                # Unassign hosts from this service
-                cursor.execute(
-                    """
+        with self._session() as (conn, cursor):
+            # Release the hosts and racks of the service and delete it
+            # together with its subnets and IPs in a single statement.
+            # Foreign keys are checked at the end of the statement, after
+            # every part has run.
+            cursor.execute(
+                """
+                WITH deleted AS (
+                    DELETE FROM services WHERE name = %s RETURNING name
+                ), released_hosts AS (
                     UPDATE hosts
                     SET service_name = NULL,
                         running = FALSE,
                         ip = NULL
-                    WHERE service_name = %s
-                    """,
-                    (service_name,)
+                    WHERE service_name IN (SELECT name FROM deleted)
+                ), released_racks AS (
+                    UPDATE racks SET service_name = NULL
+                    WHERE service_name IN (SELECT name FROM deleted)
+                ), deleted_subnets AS (
+                    DELETE FROM subnets
+                    WHERE service_name IN (SELECT name FROM deleted)
+                ), deleted_ips AS (
+                    DELETE FROM IPs
+                    WHERE service_name IN (SELECT name FROM deleted)
                 )
+                SELECT 1 FROM deleted
+                """,
+                (service_name,),
+            )
+            deleted = cursor.fetchone() is not None
 
-                # Unassign racks from this service
-                cursor.execute(
-                    "UPDATE racks SET service_name = NULL WHERE service_name = %s",
-                    (service_name,)
-                )
+            # Commit all changes
+            conn.commit()
 
-                # delete subnet from this service
-                cursor.execute(
-                    "DELETE FROM subnets WHERE service_name = %s",
-                    (service_name,)
-                )
-
-                # delete IP addresses
-                cursor.execute(
-                    "DELETE FROM IPs WHERE service_name = %s",
-                    (service_name,)
-                )
-
-                # Delete the service
-                cursor.execute("DELETE FROM services WHERE name = %s", (service_name,))
-
-                # Commit all changes
-                conn.commit()
-
-                # Check if any rows were affected
-                return cursor.rowcount > 0
-
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+            return deleted
+    @invalidates_cache
     def extendsubnet(
         self, service_name: str, new_subnet: str
     ) -> Service | None:
@@ -649,78 +518,41 @@ class ServiceManager(BaseManager):
             Service: Updated Service object
             None: If service not found or update fails
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                # Check if service exists
-                cursor.execute(
-                    "SELECT * FROM services WHERE name = %s", (service_name,)
-                )
-                service = cursor.fetchone()
-                if not service:
-                    return None
-
-                # Generate IP list from new subnet
-                try:
-                    ipaddress.ip_network(new_subnet, strict=True)
-                except ValueError:
-                    raise Exception(f"Invalid subnet: {new_subnet}")
-                # Check if subnet already exists in the database
-                network = ipaddress.ip_network(new_subnet, strict=False)
-                standardized_subnet = str(network.supernet(new_prefix=network.prefixlen))
-                cursor.execute(
-                    "SELECT * FROM subnets WHERE subnet = %s", (standardized_subnet,)
-                )
-                existing_subnet = cursor.fetchone()
-                if existing_subnet:
-                    raise Exception(f"Subnet {new_subnet} already exists in the database")
-                ip_list = self.subnet_to_iplist(new_subnet)
-
-                # Find existing IPs in the database
-                # cursor.execute(
-                #     "SELECT * FROM IPs WHERE ip::text = ANY(%s::text[])", (ip_list,)
-                # )
-                # existing_ips = cursor.fetchall()
-                # if existing_ips:
-                #     raise Exception(
-                #         f"IP addresses {', '.join(ip['ip'] for ip in existing_ips)} already exist in the database"
-                #     )
-
-                # Insert the new subnet into the subnets table
+        with self._session() as (conn, cursor):
+            # Insert the new subnet into the subnets table. The service
+            # existence check is folded into the INSERT and a duplicate
+            # subnet is skipped, so either way no row is returned. The CIDR
+            # cast rejects malformed subnets and subnets with host bits set.
+            try:
                 cursor.execute(
                     """
                     INSERT INTO subnets (subnet, service_name)
-                    VALUES (%s, %s)
+                    SELECT %s::cidr, name FROM services WHERE name = %s
                     ON CONFLICT (subnet) DO NOTHING
                     RETURNING subnet
                     """,
                     (new_subnet, service_name),
                 )
+            except InvalidTextRepresentation:
+                raise Exception(f"Invalid subnet: {new_subnet}")
+            if cursor.fetchone() is None:
+                cursor.execute(
+                    "SELECT 1 FROM services WHERE name = %s", (service_name,)
+                )
+                if cursor.fetchone() is None:
+                    return None
+                raise Exception(f"Subnet {new_subnet} already exists in the database")
 
-                for ip in ip_list:
-                    cursor.execute(
-                        """
-                        INSERT INTO IPs (ip, service_name, assigned)
-                        VALUES (%s, %s, FALSE)
-                        """,
-                        (ip, service_name)
-                    )
-
-                # Commit all changes
-                conn.commit()
+            self._insert_subnet_ips(cursor, service_name, new_subnet)
 
-                # Return the updated service
-                return self.getService(service_name)
+            # Commit all changes
+            conn.commit()
 
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        # Return the updated service, read after the connection is released
+        # so the read does not hold a second pooled connection
+        return self.getService(service_name)
 
+    @invalidates_cache
     def assignRackToService(self, service_name: str, rack_name: str) -> bool:
         """
         Assign a rack to a service.
@@ -732,63 +564,55 @@ class ServiceManager(BaseManager):
         Returns:
             bool: True if assignment was successful, False otherwise
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor() as cursor:
-                # Check if service exists
-                cursor.execute(
-                    "SELECT name FROM services WHERE name = %s", (service_name,)
-                )
-                if cursor.fetchone() is None:
-                    return False
-
-                # Check if rack exists
-                cursor.execute("SELECT name FROM racks WHERE name = %s", (rack_name,))
-                if cursor.fetchone() is None:
-                    return False
+        with self._session() as (conn, cursor):
+            # Assign the rack in a single statement, it only matches if
+            # the service exists and the rack is free and has no hosts
+            cursor.execute(
+                """
+                UPDATE racks SET service_name = s.name
+                FROM services s
+                WHERE s.name = %s AND racks.name = %s
+                    AND racks.service_name IS NULL
+                    AND NOT EXISTS (
+                        SELECT 1 FROM hosts WHERE hosts.rack_name = racks.name
+                    )
+                """,
+                (service_name, rack_name),
+            )
 
-                # Check if the rack is already assigned to a service
+            if cursor.rowcount <= 0:
+                # Find out why nothing was assigned
                 cursor.execute(
-                    "SELECT service_name FROM racks WHERE name = %s", (rack_name,)
+                    """
+                    SELECT
+                        EXISTS (SELECT 1 FROM services WHERE name = %s),
+                        r.service_name,
+                        EXISTS (SELECT 1 FROM hosts WHERE rack_name = r.name)
+                    FROM racks r
+                    WHERE r.name = %s
+                    """,
+                    (service_name, rack_name),
                 )
                 result = cursor.fetchone()
-                if result is not None and result[0] is not None:
+                if result is None or not result[0]:
+                    return False
+                if result[1] is not None:
                     raise Exception(
                         f"Rack {rack_name} is already assigned to a service"
                     )
-                # check rack don't have any hosts assigned to it
-                cursor.execute(
-                    "SELECT COUNT(*) FROM hosts WHERE rack_name = %s", (rack_name,)
-                )
-                host_count = cursor.fetchone()[0]
-                if host_count > 0:
+                if result[2]:
                     # Rack has hosts assigned to it, cannot assign to service
                     raise Exception(
                         f"Rack {rack_name} has hosts assigned to it, cannot assign to service {service_name}"
                     )
-                # Assign the rack to the service
-                cursor.execute(
-                    "UPDATE racks SET service_name = %s WHERE name = %s",
-                    (service_name, rack_name),
-                )
-
-                if cursor.rowcount <= 0:
-                    return False
-
-                # Commit changes
-                conn.commit()
+                return False
 
-                return True
+            # Commit changes
+            conn.commit()
 
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+            return True
 
+    @invalidates_cache
     def unassignRackFromService(self, rack_name: str) -> bool:
         """
         Unassign a rack from any service.
@@ -799,46 +623,39 @@ class ServiceManager(BaseManager):
         Returns:
             bool: True if unassignment was successful, False otherwise
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor() as cursor:
-                # Check if rack exists and is assigned to a service
-                cursor.execute(
-                    "SELECT service_name FROM racks WHERE name = %s", (rack_name,)
-                )
-                result = cursor.fetchone()
-                if result is None:
-                    return False
+        with self._session() as (conn, cursor):
+            # Check if rack exists and is assigned to a service
+            cursor.execute(
+                "SELECT service_name FROM racks WHERE name = %s", (rack_name,)
+            )
+            result = cursor.fetchone()
+            if result is None:
+                return False
+
+            service_name = result[0]
+            if service_name is None:
+                # Rack is not assigned to any service
+                return True
 
-                service_name = result[0]
-                if service_name is None:
-                    # Rack is not assigned to any service
-                    return True
+            # First unassign any hosts in this rack from the service
+            cursor.execute(
+                "UPDATE hosts SET service_name = NULL WHERE rack_name = %s AND service_name = %s",
+                (rack_name, service_name)
+            )
 
-                # First unassign any hosts in this rack from the service
-                cursor.execute(
-                    "UPDATE hosts SET service_name = NULL WHERE rack_name = %s AND service_name = %s",
-                    (rack_name, service_name)
-                )
+            # Unassign rack from service
+            cursor.execute(
+                "UPDATE racks SET service_name = NULL WHERE name = %s", (rack_name,)
+            )
 
-                # Unassign rack from service
-                cursor.execute(
-                    "UPDATE racks SET service_name = NULL WHERE name = %s", (rack_name,)
-                )
+            if cursor.rowcount <= 0:
+                return False
 
-                if cursor.rowcount <= 0:
-                    return False
+            # Commit changes
+            conn.commit()
 
-                # Commit changes
-                conn.commit()
+            return True
 
-                return True
 
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+# Shared instance used by the blueprints
+service_manager = ServiceManager()
@@ -243,7 +243,7 @@ def test_host_crud(rack_name):
     print(f"更新後主機: {host_updated.name}, 運行狀態: {host_updated.running}")
     
     # 查詢所有主機
-    all_hosts = host_manager.getAllHosts()
+    all_hosts = list(host_manager.getAllHosts())
     print(f"\n主機總數: {len(all_hosts) if all_hosts else 0}")
     
     return host_name
@@ -1,6 +1,5 @@
+import hmac
 import os
-import psycopg2
-import psycopg2.extras
 from utils.schema import DataCenter, Room, Rack, Host, Service, User
 from utils.schema import (
     SimpleRoom,
@@ -9,182 +8,129 @@ from utils.schema import (
     SimpleDataCenter,
 )
 from DataBaseManage.connection import BaseManager
+from DataBaseManage.cache import cached_query, invalidates_cache
+
+
+# SET clause of each optional updateUser field, in bit order of the update mask
+_UPDATE_USER_FIELDS = ("password = %s", "role = %s")
+
+# Precomputed statement for every combination of updated fields, keyed by the
+# bitmap built in updateUser. Without fields to update the user is returned
+# as is.
+_UPDATE_USER_QUERIES = {
+    mask: "UPDATE users SET "
+    + ", ".join(
+        part for bit, part in enumerate(_UPDATE_USER_FIELDS) if mask >> bit & 1
+    )
+    + ", updated_at = CURRENT_TIMESTAMP"
+    " WHERE username = %s RETURNING username, password, role"
+    for mask in range(1, 1 << len(_UPDATE_USER_FIELDS))
+}
+_UPDATE_USER_QUERIES[0] = (
+    "SELECT username, password, role FROM users WHERE username = %s"
+)
 
 
 class UserManager(BaseManager):
     """Class for managing User operations"""
+    @invalidates_cache
     def createUser(self, username, password, role):
         """
         Create a new User.
         Returns the created User object or None if creation fails.
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                # Insert new user
-                cursor.execute(
-                    "INSERT INTO users(username, password, role) VALUES (%s, %s, %s) ",
-                    (username, password, role),
-                )
-                conn.commit()
+        with self._session(row_class=User) as (conn, cursor):
+            # Insert new user, RETURNING saves reading it back
+            self.execute_cached(
+                cursor,
+                "INSERT INTO users(username, password, role) VALUES (%s, %s, %s)"
+                " RETURNING username, password, role",
+                (username, password, role),
+            )
+            user = cursor.fetchone()
+            conn.commit()
 
-                # Return the new user as a User object
-                return self.getUser(username)
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+            return user
 
     # User operations
+    @cached_query
     def getUser(self, username=None):
         """
         Get user information.
         Returns None if user_id/username is provided but not found.
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                if username:
-                    cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-                    data = cursor.fetchone()
-                    if not data:
-                        return None
-
-                    # Create and return a User object
-                    return User(
-                        username=data["username"],
-                        password=data["password"],
-                        role=data["role"],
-                    )
-                else:
-                    # Get all users
-                    cursor.execute("SELECT * FROM users ORDER BY username")
-                    users_data = cursor.fetchall()
-
-                    # Create a list to store User objects
-                    users = []
-
-                    # Process each user
-                    for data in users_data:
-                        # Create User object and append to list
-                        users.append(
-                            User(
-                                username=data["username"],
-                                password=data["password"],
-                                role=data["role"],
-                            )
-                        )
-
-                    return users
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
-
+        # Rows are returned as User objects, columns are in User field order
+        with self._session(readonly=True, row_class=User) as (conn, cursor):
+            if username:
+                self.execute_cached(
+                    cursor,
+                    "SELECT username, password, role FROM users WHERE username = %s",
+                    (username,),
+                )
+                return cursor.fetchone()
+            else:
+                # Get all users
+                self.execute_cached(
+                    cursor,
+                    "SELECT username, password, role FROM users ORDER BY username"
+                )
+                return cursor.fetchall()
 
+    @invalidates_cache
     def updateUser(self, username, password=None, role=None):
         """
         Update an existing User.
         Returns the updated User object or None if update fails.
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:  # 使用 RealDictCursor
-                cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-                user = cursor.fetchone()
-                if not user:
-                    print(f"User {username} does not exist")
-                    return None
-                
-                update_fields = []
-                params = []
-                
-                # add fields to update if they are not None
-                if password is not None:
-                    update_fields.append("password = %s")
-                    params.append(password)
-    
-                if role is not None:
-                    update_fields.append("role = %s")
-                    params.append(role)
-    
-                # if no fields to update, return the user as is
-                if not update_fields:
-                    return self.getUser(username)
-                update_fields.append("updated_at = CURRENT_TIMESTAMP")
-                    
-                query = f"UPDATE users SET {', '.join(update_fields)} WHERE username = %s"
-                params.append(username)
-                cursor.execute(query, params)
-                conn.commit()
-    
-                return self.getUser(username)
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            print(f"Error updating user: {e}")
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session(row_class=User) as (conn, cursor):
+            mask = (password is not None) | (role is not None) << 1
+            params = [v for v in (password, role) if v is not None]
+            params.append(username)
+            self.execute_cached(cursor, _UPDATE_USER_QUERIES[mask], params)
+            user = cursor.fetchone()
+            conn.commit()
+
+            # No row means the user does not exist
+            if user is None:
+                print(f"User {username} does not exist")
+
+            return user
 
+    @invalidates_cache
     def deleteUser(self, username):
         """
         Delete a User.
         Returns True if deletion was successful, False otherwise.
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor() as cursor:
-                cursor.execute("DELETE FROM users WHERE username = %s", (username,))
-                deleted = cursor.rowcount > 0
-                conn.commit()
-                return deleted
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+        with self._session() as (conn, cursor):
+            self.execute_cached(
+                cursor, "DELETE FROM users WHERE username = %s", (username,)
+            )
+            deleted = cursor.rowcount > 0
+            conn.commit()
+            return deleted
 
     def authenticate(self, username, password):
         """
         Authenticate a user.
         Returns the User object if authentication is successful, None otherwise.
         """
-        conn = None
-        try:
-            conn = self.get_connection()
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT * FROM users WHERE username = %s AND password = %s",
-                    (username, password),
-                )
-                data = cursor.fetchone()
-                if not data:
-                    return None
+        with self._session(readonly=True, row_class=User) as (conn, cursor):
+            # Look the user up by username only and compare the password
+            # here in constant time
+            self.execute_cached(
+                cursor,
+                "SELECT username, password, role FROM users WHERE username = %s",
+                (username,),
+            )
+            user = cursor.fetchone()
+            if user is None or not hmac.compare_digest(
+                user.password.encode(), str(password).encode()
+            ):
+                return None
 
-                # Create and return a User object
-                return User(
-                    username=data["username"],
-                    password=data["password"],
-                    role=data["role"],
-                )
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                self.release_connection(conn)
+            return user
+
+
+# Shared instance used by the blueprints
+user_manager = UserManager()
@@ -1,7 +1,5 @@
 -- CREATE DATABASE datacenter_management;
 
-CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
-
 ------------------------------------------------------------
 -------------  Table Creation and Constraints --------------
 ------------------------------------------------------------
@@ -79,12 +77,115 @@ CREATE TABLE hosts (
 
 
 CREATE TABLE subnets (
-    subnet VARCHAR(255) PRIMARY KEY, -- Subnet address
+    subnet CIDR PRIMARY KEY, -- Subnet address
     service_name VARCHAR(255) NOT NULL REFERENCES services(name) ON UPDATE CASCADE, -- Name of the service (redundant for faster access)
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Usable host addresses of a subnet, matching Python's ip_network().hosts():
+-- the network and broadcast addresses are skipped, except in /31 and /32
+-- (/127 and /128) subnets. IPv6 subnets only skip the network address.
+CREATE OR REPLACE FUNCTION subnet_hosts(subnet CIDR) RETURNS SETOF INET AS $$
+    SELECT host(subnet + i)::inet
+    FROM (
+        SELECT CASE family(subnet) WHEN 4 THEN 32 ELSE 128 END - masklen(subnet) AS bits
+    ) AS size,
+    generate_series(
+        CASE WHEN bits < 2 THEN 0 ELSE 1 END,
+        (power(2::numeric, bits) - 1)::bigint
+            - CASE WHEN bits >= 2 AND family(subnet) = 4 THEN 1 ELSE 0 END
+    ) AS i
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+------------------------------------------------------------
+-------------  Triggers for Redundant Columns --------------
+------------------------------------------------------------
+-- racks and hosts keep a copy of the room and datacenter they are in.
+-- These triggers keep the copies in sync, so moving a room or a rack
+-- updates everything inside it without extra statements in the backend.
+
+-- Fill a host's room and datacenter from its rack
+CREATE OR REPLACE FUNCTION sync_host_location() RETURNS trigger AS $$
+BEGIN
+    SELECT room_name, dc_name INTO NEW.room_name, NEW.dc_name
+    FROM racks WHERE name = NEW.rack_name;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER hosts_sync_location
+    BEFORE INSERT OR UPDATE OF rack_name ON hosts
+    FOR EACH ROW EXECUTE FUNCTION sync_host_location();
+
+-- Move the hosts of a rack along with the rack
+CREATE OR REPLACE FUNCTION sync_rack_hosts_location() RETURNS trigger AS $$
+BEGIN
+    UPDATE hosts SET room_name = NEW.room_name, dc_name = NEW.dc_name
+    WHERE rack_name = NEW.name
+        AND (room_name IS DISTINCT FROM NEW.room_name
+            OR dc_name IS DISTINCT FROM NEW.dc_name);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER racks_sync_hosts_location
+    AFTER UPDATE OF room_name, dc_name ON racks
+    FOR EACH ROW EXECUTE FUNCTION sync_rack_hosts_location();
+
+-- Move the racks of a room, and through them its hosts, along with the room
+CREATE OR REPLACE FUNCTION sync_room_racks_location() RETURNS trigger AS $$
+BEGIN
+    UPDATE racks SET dc_name = NEW.dc_name
+    WHERE room_name = NEW.name AND dc_name IS DISTINCT FROM NEW.dc_name;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER rooms_sync_racks_location
+    AFTER UPDATE OF dc_name ON rooms
+    FOR EACH ROW EXECUTE FUNCTION sync_room_racks_location();
+
+------------------------------------------------------------
+-------------  Indexes for Lookup Columns ------------------
+------------------------------------------------------------
+-- Foreign key / filter columns used by the backend's WHERE clauses.
+-- hosts(rack_name) is already covered by unique_rack_position.
+CREATE INDEX idx_services_username ON services(username);
+CREATE INDEX idx_rooms_dc_name ON rooms(dc_name);
+CREATE INDEX idx_racks_dc_name ON racks(dc_name);
+CREATE INDEX idx_racks_room_name ON racks(room_name);
+CREATE INDEX idx_racks_service_name ON racks(service_name);
+CREATE INDEX idx_ips_service_name_assigned ON IPs(service_name, assigned, ip); -- free IP lookup
+CREATE UNIQUE INDEX ux_hosts_ip ON hosts(ip); -- an IP belongs to at most one host
+CREATE INDEX idx_hosts_dc_name ON hosts(dc_name);
+CREATE INDEX idx_hosts_room_name ON hosts(room_name);
+CREATE INDEX idx_hosts_service_name_rack_name ON hosts(service_name, rack_name);
+CREATE INDEX idx_subnets_service_name ON subnets(service_name);
+
+------------------------------------------------------------
+-------------  Datacenter Counts View ----------------------
+------------------------------------------------------------
+-- Height and room, rack and host counts of each datacenter. The counts are
+-- computed on read so there are no counters to keep in sync on every
+-- write. A plain view, since the grouped scans are cheap on the dc_name
+-- indexes.
+CREATE OR REPLACE VIEW datacenter_counts AS
+SELECT d.name, d.height,
+    COALESCE(ro.n_rooms, 0) AS n_rooms,
+    COALESCE(ra.n_racks, 0) AS n_racks,
+    COALESCE(h.n_hosts, 0) AS n_hosts
+FROM datacenters d
+LEFT JOIN (
+    SELECT dc_name, COUNT(*) AS n_rooms FROM rooms GROUP BY dc_name
+) ro ON ro.dc_name = d.name
+LEFT JOIN (
+    SELECT dc_name, COUNT(*) AS n_racks FROM racks GROUP BY dc_name
+) ra ON ra.dc_name = d.name
+LEFT JOIN (
+    SELECT dc_name, COUNT(*) AS n_hosts FROM hosts GROUP BY dc_name
+) h ON h.dc_name = d.name;
+
 -- set up mock data --
 INSERT INTO users (username, password, role) VALUES ('admin', '123', 'admin') ON CONFLICT DO NOTHING;
 INSERT INTO users (username, password, role) VALUES ('user1', '123', 'normal') ON CONFLICT DO NOTHING;
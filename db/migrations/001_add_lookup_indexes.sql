@@ -0,0 +1,15 @@
+-- Add indexes on the lookup columns of an existing database.
+-- New databases get them from database_setup.sql.
+-- CONCURRENTLY cannot run inside a transaction, run with:
+--   psql -U postgres -d datacenter_management -f db/migrations/001_add_lookup_indexes.sql
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_services_username ON services(username);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rooms_dc_name ON rooms(dc_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_racks_dc_name ON racks(dc_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_racks_room_name ON racks(room_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_racks_service_name ON racks(service_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ips_service_name_assigned ON IPs(service_name, assigned, ip);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_hosts_ip ON hosts(ip);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_hosts_dc_name ON hosts(dc_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_hosts_room_name ON hosts(room_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_hosts_service_name ON hosts(service_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_subnets_service_name ON subnets(service_name);
@@ -0,0 +1,56 @@
+-- Add the triggers that keep the room and datacenter copies on racks and
+-- hosts in sync to an existing database, and repair rows that went stale.
+-- New databases get the triggers from database_setup.sql.
+--   psql -U postgres -d datacenter_management -f db/migrations/002_sync_location_triggers.sql
+BEGIN;
+-- Fill a host's room and datacenter from its rack
+CREATE OR REPLACE FUNCTION sync_host_location() RETURNS trigger AS $$
+BEGIN
+    SELECT room_name, dc_name INTO NEW.room_name, NEW.dc_name
+    FROM racks WHERE name = NEW.rack_name;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER hosts_sync_location
+    BEFORE INSERT OR UPDATE OF rack_name ON hosts
+    FOR EACH ROW EXECUTE FUNCTION sync_host_location();
+
+-- Move the hosts of a rack along with the rack
+CREATE OR REPLACE FUNCTION sync_rack_hosts_location() RETURNS trigger AS $$
+BEGIN
+    UPDATE hosts SET room_name = NEW.room_name, dc_name = NEW.dc_name
+    WHERE rack_name = NEW.name
+        AND (room_name IS DISTINCT FROM NEW.room_name
+            OR dc_name IS DISTINCT FROM NEW.dc_name);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER racks_sync_hosts_location
+    AFTER UPDATE OF room_name, dc_name ON racks
+    FOR EACH ROW EXECUTE FUNCTION sync_rack_hosts_location();
+
+-- Move the racks of a room, and through them its hosts, along with the room
+CREATE OR REPLACE FUNCTION sync_room_racks_location() RETURNS trigger AS $$
+BEGIN
+    UPDATE racks SET dc_name = NEW.dc_name
+    WHERE room_name = NEW.name AND dc_name IS DISTINCT FROM NEW.dc_name;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER rooms_sync_racks_location
+    AFTER UPDATE OF dc_name ON rooms
+    FOR EACH ROW EXECUTE FUNCTION sync_room_racks_location();
+
+UPDATE racks SET dc_name = rooms.dc_name
+FROM rooms
+WHERE racks.room_name = rooms.name AND racks.dc_name IS DISTINCT FROM rooms.dc_name;
+
+UPDATE hosts SET room_name = racks.room_name, dc_name = racks.dc_name
+FROM racks
+WHERE hosts.rack_name = racks.name
+    AND (hosts.room_name IS DISTINCT FROM racks.room_name
+        OR hosts.dc_name IS DISTINCT FROM racks.dc_name);
+COMMIT;
@@ -0,0 +1,9 @@
+-- Make hosts.ip unique and index hosts by service and rack on an existing
+-- database. New databases get these indexes from database_setup.sql.
+-- The unique index fails to build if two hosts already share an IP.
+-- CONCURRENTLY cannot run inside a transaction, run with:
+--   psql -U postgres -d datacenter_management -f db/migrations/003_hosts_composite_indexes.sql
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_hosts_ip ON hosts(ip);
+DROP INDEX CONCURRENTLY IF EXISTS idx_hosts_ip;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_hosts_service_name_rack_name ON hosts(service_name, rack_name);
+DROP INDEX CONCURRENTLY IF EXISTS idx_hosts_service_name;
@@ -0,0 +1,6 @@
+-- Store subnets as CIDR instead of text on an existing database, so they
+-- sort by address and malformed subnets are rejected by the database.
+-- New databases get the CIDR column from database_setup.sql.
+-- Fails if a stored subnet is not a valid network address.
+--   psql -U postgres -d datacenter_management -f db/migrations/004_subnets_cidr.sql
+ALTER TABLE subnets ALTER COLUMN subnet TYPE CIDR USING subnet::cidr;
@@ -0,0 +1,18 @@
+-- Add the datacenter_counts view to an existing database.
+-- New databases get it from database_setup.sql.
+--   psql -U postgres -d datacenter_management -f db/migrations/005_datacenter_counts_view.sql
+CREATE OR REPLACE VIEW datacenter_counts AS
+SELECT d.name, d.height,
+    COALESCE(ro.n_rooms, 0) AS n_rooms,
+    COALESCE(ra.n_racks, 0) AS n_racks,
+    COALESCE(h.n_hosts, 0) AS n_hosts
+FROM datacenters d
+LEFT JOIN (
+    SELECT dc_name, COUNT(*) AS n_rooms FROM rooms GROUP BY dc_name
+) ro ON ro.dc_name = d.name
+LEFT JOIN (
+    SELECT dc_name, COUNT(*) AS n_racks FROM racks GROUP BY dc_name
+) ra ON ra.dc_name = d.name
+LEFT JOIN (
+    SELECT dc_name, COUNT(*) AS n_hosts FROM hosts GROUP BY dc_name
+) h ON h.dc_name = d.name;
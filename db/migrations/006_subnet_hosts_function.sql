@@ -0,0 +1,17 @@
+-- Add the subnet_hosts() function used to generate the IPs of a subnet to
+-- an existing database. New databases get it from database_setup.sql.
+--   psql -U postgres -d datacenter_management -f db/migrations/006_subnet_hosts_function.sql
+-- Usable host addresses of a subnet, matching Python's ip_network().hosts():
+-- the network and broadcast addresses are skipped, except in /31 and /32
+-- (/127 and /128) subnets. IPv6 subnets only skip the network address.
+CREATE OR REPLACE FUNCTION subnet_hosts(subnet CIDR) RETURNS SETOF INET AS $$
+    SELECT host(subnet + i)::inet
+    FROM (
+        SELECT CASE family(subnet) WHEN 4 THEN 32 ELSE 128 END - masklen(subnet) AS bits
+    ) AS size,
+    generate_series(
+        CASE WHEN bits < 2 THEN 0 ELSE 1 END,
+        (power(2::numeric, bits) - 1)::bigint
+            - CASE WHEN bits >= 2 AND family(subnet) = 4 THEN 1 ELSE 0 END
+    ) AS i
+$$ LANGUAGE sql IMMUTABLE STRICT;
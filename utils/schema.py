@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from enum import Enum
 
 
-@dataclass
+@dataclass(slots=True)
 class Host:
     name: str
     height: int
@@ -15,7 +15,7 @@ class Host:
     pos: int  # 在rack的第幾個位置
 
 
-@dataclass
+@dataclass(slots=True)
 class Rack:
     name: str
     height: int
@@ -27,7 +27,7 @@ class Rack:
     room_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class SimpleRack:
     name: str
     height: int
@@ -37,7 +37,7 @@ class SimpleRack:
     room_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Room:
     name: str
     height: int
@@ -47,7 +47,7 @@ class Room:
     dc_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class SimpleRoom:
     name: str
     height: int
@@ -56,7 +56,7 @@ class SimpleRoom:
     dc_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class DataCenter:
     name: str
     height: int
@@ -66,7 +66,7 @@ class DataCenter:
     n_hosts: int
 
 
-@dataclass
+@dataclass(slots=True)
 class SimpleDataCenter:
     name: str
     height: int
@@ -75,7 +75,7 @@ class SimpleDataCenter:
     n_hosts: int
 
 
-@dataclass
+@dataclass(slots=True)
 class Service:
     name: str
     allocated_racks: dict[
@@ -88,7 +88,7 @@ class Service:
     available_ip_list: list[str]
 
 
-@dataclass
+@dataclass(slots=True)
 class SimpleService:
     name: str
     n_allocated_racks: dict[str, int]  # how many racks are allocated in each dc
@@ -104,7 +104,7 @@ class UserRole(Enum):
     ADMIN  = "admin"
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     username: str
     password: str